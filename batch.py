@@ -0,0 +1,212 @@
+'''
+    Batch analytics of recorded videos.
+
+    Videos are processed in parallel on a process pool,
+    every worker owns one FaceToolkit. Results of every
+    finished tracklet are written as JSON lines to
+    <output_dir>/<video name>.jsonl, completed videos are
+    recorded to the progress file, so an interrupted run
+    is resumed by starting the same command again.
+
+    Usage:
+        python batch.py [-j JOBS] [-o OUTPUT_DIR] VIDEO_OR_DIR [...]
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import os.path as osp
+import time
+
+import config
+
+
+VIDEO_EXTENSIONS = (".avi", ".mkv", ".mp4", ".mov", ".ts", ".m4v")
+
+
+def find_videos(paths):
+    videos = []
+    for path in paths:
+        if osp.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.lower().endswith(VIDEO_EXTENSIONS):
+                        videos.append(osp.abspath(osp.join(root, filename)))
+        elif osp.isfile(path):
+            videos.append(osp.abspath(path))
+    return videos
+
+
+def output_path(output_dir, video):
+    # Parent directory name keeps results of equally named videos apart
+    parent = osp.basename(osp.dirname(video))
+    name = osp.splitext(osp.basename(video))[0]
+    return osp.join(output_dir, "%s_%s.jsonl" % (parent, name))
+
+
+def read_progress(progress_path):
+    done = set()
+    if osp.isfile(progress_path):
+        with open(progress_path, 'r') as progress_file:
+            for line in progress_file:
+                line = line.strip()
+                if line:
+                    done.add(json.loads(line)["video"])
+    return done
+
+
+def tracklet_result(video, entry):
+    return {
+        "video": video,
+        "tracklet_id": entry.id,
+        "start": entry.first_seen,
+        "end": entry.last_seen,
+        "attributes": entry.attributes,
+        "demographics": entry.demographics,
+        "emotion": None if entry.emotion is None else str(entry.emotion),
+        "emotions": dict(entry.emotion_votes)
+    }
+
+
+# ==========================================================
+# WORKER PROCESS
+
+# FaceToolkit of the worker process, see process_video()
+worker_ftool = None
+
+
+def init_worker():
+    import cv2
+
+    # Workers never show anything and run classifiers inline,
+    # parallelism comes from the processes, so OpenCV does not
+    # start its own threads on every core in every worker
+    cv2.setNumThreads(config.batch_cv_threads)
+    config.headless = True
+    config.async_classifiers = False
+    config.capture_threaded = False
+    config.timing_report_path = None
+
+
+def get_toolkit(video_params):
+    global worker_ftool
+    import facetools
+
+    # Models are loaded once per worker, the toolkit
+    # is rebuilt only for a different video geometry
+    if not worker_ftool is None and worker_ftool.input_params == video_params:
+        worker_ftool.reset_tracking()
+        return worker_ftool
+    worker_ftool = facetools.FaceToolkit(dict(video_params))
+    worker_ftool.input_params = video_params
+    return worker_ftool
+
+
+def write_finished(ftool, video, out_file):
+    lines = []
+    for entry in ftool.pop_finished():
+        if entry.samples == 0:
+            continue
+        lines.append(json.dumps(tracklet_result(video, entry), separators=(",", ":")))
+    if lines:
+        out_file.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def process_video(args):
+    video, out_path = args
+    import camtools
+
+    start = time.time()
+    cam = camtools.CamToolkit(video, threaded=False)
+    if cam.fps == 0:
+        cam.release()
+        return {"video": video, "error": "can't open video"}
+
+    ftool = get_toolkit(cam.video_dict)
+    frames_num = tracklets_num = 0
+
+    # Written to a temporary file, which is renamed when the video
+    # is done, so partial results are never taken as complete
+    tmp_path = out_path + ".part"
+    with open(tmp_path, 'w') as out_file:
+        while True:
+            frame = cam.get_frame()
+            if frame is None:
+                break
+            # Not main.process_frame: it hands finished tracklets
+            # to the visits journal, here they go to the results file
+            tracklets = ftool.track(frame, frame.timestamp)
+            ftool.analyze(frame, tracklets, frame.timestamp, frame)
+            frame.release()
+            frames_num += 1
+            tracklets_num += write_finished(ftool, video, out_file)
+
+        ftool.finish_all()
+        tracklets_num += write_finished(ftool, video, out_file)
+    cam.release()
+    os.replace(tmp_path, out_path)
+
+    return {
+        "video": video,
+        "output": out_path,
+        "frames": frames_num,
+        "tracklets": tracklets_num,
+        "seconds": round(time.time() - start, 2)
+    }
+
+
+# ==========================================================
+
+
+def run(videos, output_dir, jobs, progress_path=None):
+    import utils
+
+    if not osp.isdir(output_dir):
+        os.makedirs(output_dir)
+    if progress_path is None:
+        progress_path = osp.join(output_dir, "progress.jsonl")
+
+    done = read_progress(progress_path)
+    todo = [(video, output_path(output_dir, video)) for video in videos if not video in done]
+    utils.log("Videos: %d, already done: %d, to process: %d" % (
+        len(videos), len(videos) - len(todo), len(todo)))
+    if not todo:
+        return
+
+    start = time.time()
+    frames_num = 0
+    pool = multiprocessing.Pool(jobs, initializer=init_worker)
+    try:
+        with open(progress_path, 'a') as progress_file:
+            for result in pool.imap_unordered(process_video, todo):
+                if "error" in result:
+                    utils.log("%s: %s" % (result["video"], result["error"]))
+                    continue
+                progress_file.write(json.dumps(result) + "\n")
+                progress_file.flush()
+                frames_num += result["frames"]
+                utils.log("%s: %d frames, %d tracklets in %.1f s" % (
+                    result["video"], result["frames"], result["tracklets"], result["seconds"]))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    utils.log("Processed %d frames in %.1f s (%.1f fps)" % (
+        frames_num, elapsed, frames_num / max(elapsed, 1e-6)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch analytics of recorded videos")
+    parser.add_argument("paths", nargs="+", help="video files or directories")
+    parser.add_argument("-o", "--output-dir", default=config.batch_output_dir)
+    parser.add_argument("-j", "--jobs", type=int, default=config.batch_jobs or os.cpu_count())
+    parser.add_argument("--progress", default=None, help="progress file (default: <output_dir>/progress.jsonl)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(find_videos(args.paths), args.output_dir, args.jobs, args.progress)
@@ -0,0 +1,90 @@
+'''
+    Compares vectorized gallery.GalleryIndex search
+    with the loop version of FaceToolkit.recognize_person
+    across gallery sizes. Both versions score persons with
+    the SDK matcher (FACESDK_BACKEND=fake for the stand-in).
+
+    Usage:
+        python benchmarks/gallery_bench.py [descriptor_size]
+'''
+import os.path as osp
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from gallery import GalleryIndex
+from sdk import IMatcher
+import config
+import utils
+
+
+GALLERY_SIZES = (100, 1000, 5000, 20000)
+DESCRIPTORS_PER_PERSON = 3
+QUERIES = 20
+
+
+def make_persons_data(persons_num, desc_size, rng):
+    persons = []
+    for i in range(persons_num):
+        # Descriptors of one person are noisy copies of a base one
+        base = rng.integers(0, 256, desc_size)
+        noise = rng.integers(-8, 9, (DESCRIPTORS_PER_PERSON, desc_size))
+        persons.append({
+            "id": i,
+            "name": "person_%d" % i,
+            "descriptors_raw": np.clip(base + noise, 0, 255).tolist()
+        })
+    return {"persons": persons}
+
+
+def loop_search(matcher, persons_data, query):
+    # Same structure as recognize_person before the index was added
+    query_desc = utils.list2desc(query)
+    best_name, best_score = "unknown", 0.0
+    for pers in persons_data["persons"]:
+        sum_score = 0.0
+        for desc in pers["descriptors_raw"]:
+            sum_score += matcher.match(utils.list2desc(desc), query_desc)
+        avg_score = sum_score / len(pers["descriptors_raw"])
+        if avg_score < config.recognition_threshold:
+            continue
+        if avg_score > best_score:
+            best_name, best_score = pers["name"], avg_score
+    return best_name, best_score
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main(desc_size=512):
+    rng = np.random.default_rng(0)
+    matcher = IMatcher()
+    print("%10s %14s %14s %10s" % ("persons", "loop, ms", "index, ms", "speedup"))
+    for size in GALLERY_SIZES:
+        persons_data = make_persons_data(size, desc_size, rng)
+        index = GalleryIndex.from_persons_data(persons_data)
+
+        # Query is a noisy copy of a known person, so both versions must agree
+        known = np.array(persons_data["persons"][size // 2]["descriptors_raw"][0])
+        query = np.clip(known + rng.integers(-8, 9, desc_size), 0, 255).astype(np.uint8)
+
+        loop_name, loop_score = loop_search(matcher, persons_data, query)
+        index_match = index.search(query, matcher)
+        assert index_match and index_match[0]["name"] == loop_name
+        assert abs(index_match[0]["score"] - loop_score) < 1e-6
+
+        loop_repeat = max(1, QUERIES * 100 // size)
+        loop_ms = timeit(lambda: loop_search(matcher, persons_data, query), loop_repeat)
+        index_ms = timeit(lambda: index.search(query, matcher, k=5), QUERIES)
+        print("%10d %14.3f %14.3f %9.1fx" % (size, loop_ms, index_ms, loop_ms / index_ms))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,141 @@
+'''
+    Offline benchmark of the processing pipeline on
+    synthetic video with the fake FaceSDK backend.
+
+    Measures end-to-end frames/sec of main.process_frame,
+    per-stage cost from timing.timer, FaceToolkit.analyze
+    with and without the results cache and the hot utils
+    drawing functions.
+
+    Usage:
+        python benchmarks/pipeline_bench.py [frames] [--no-latency]
+
+    --no-latency sets all synthetic SDK latencies to zero,
+    so only the Python side of the pipeline is measured.
+'''
+import os
+import os.path as osp
+import sys
+import time
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+os.environ["FACESDK_BACKEND"] = "fake"
+
+import numpy as np
+
+import config
+config.debug_mode = False
+config.timing_report_path = None
+config.timing_report_interval = 1e9
+
+import fakesdk
+import compositor
+import facetools
+import frames
+import main
+import timing
+import utils
+
+
+WIDTH, HEIGHT, FPS = 1280, 720, 25
+
+
+def synthetic_video(frames_num, seed=0):
+    # A few noise frames are enough, decoding is not measured here
+    rng = np.random.default_rng(seed)
+    pool = [rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8) for _ in range(4)]
+    for n in range(frames_num):
+        yield frames.Frame(pool[n % len(pool)])
+
+
+def video_dict():
+    return {"w": WIDTH, "h": HEIGHT, "fps": FPS, "roi": None}
+
+
+def bench_pipeline(frames_num):
+    ftool = facetools.FaceToolkit(video_dict())
+    timing.timer.reset()
+    frames.reset_stats()
+    time_step = 1000 // FPS
+    timestamp = 0
+    tracklets_num = 0
+
+    start = time.perf_counter()
+    for frame in synthetic_video(frames_num):
+        timestamp += time_step
+        with timing.timer.stage("frame"):
+            tracklets, analysis = main.process_frame(ftool, frame, timestamp)
+        tracklets_num += len(tracklets)
+    elapsed = time.perf_counter() - start
+
+    print("Pipeline: %d frames, %.1f tracklets/frame, %.1f fps" % (
+        frames_num, float(tracklets_num) / frames_num, frames_num / elapsed))
+    print("Image8U conversions per frame: %.2f" % (
+        float(frames.stats["conversions"]) / frames_num))
+    print("%-16s %10s %10s %10s %10s" % ("stage, ms", "calls", "p50", "p95", "p99"))
+    for name, stat in sorted(timing.timer.summary()["stages"].items()):
+        print("%-16s %10d %10.3f %10.3f %10.3f" % (
+            name, stat["count"], stat["p50"], stat["p95"], stat["p99"]))
+
+
+def bench_analyze(frames_num):
+    ftool = facetools.FaceToolkit(video_dict())
+    frame8u = next(synthetic_video(1)).image8u
+    time_step = 1000 // FPS
+
+    for cached in (False, True):
+        tracker = fakesdk.IGlobalTracker()
+        timestamp = 0
+        start = time.perf_counter()
+        for _ in range(frames_num):
+            timestamp += time_step
+            tracker.process(frame8u, timestamp)
+            ftool.analyze(frame8u, tracker.tracklets, timestamp if cached else None)
+        elapsed = time.perf_counter() - start
+        print("FaceToolkit.analyze (%s): %.3f ms/frame" % (
+            "cached" if cached else "uncached", elapsed / frames_num * 1000.0))
+
+
+def bench_utils(repeat=200):
+    frame = next(synthetic_video(1)).pixels.copy()
+    tracker = fakesdk.IGlobalTracker()
+    tracker.process(fakesdk.Image8U(frame), 3000)
+    tlet = tracker.tracklets[0]
+    lines = {"sep1": "___", "gender": "MALE", "age": 30, "emotion": "HAPPY"}
+    overlay = compositor.OverlayCompositor()
+
+    def compose():
+        view = overlay.begin(frame)
+        utils.draw_tracklet_on_frame(view, tlet, tlet_age=100, tlet_state="TRACKED")
+        overlay.draw_panel([(tlet.id, lines)])
+
+    cases = {
+        "draw_tracklet_on_frame": lambda: utils.draw_tracklet_on_frame(
+            frame, tlet, tlet_age=100, tlet_state="TRACKED"),
+        "info_bar": lambda: utils.put_text_from_dict_on_image(
+            utils.create_blank_image(HEIGHT, int(WIDTH * 0.4)), lines, "left-top"),
+        "concatenate": lambda: np.concatenate(
+            (utils.create_blank_image(HEIGHT, int(WIDTH * 0.4)), frame), axis=1),
+        "compositor": compose,
+        "list2desc": lambda: utils.list2desc(list(range(256)) * 2),
+    }
+    for name, fn in cases.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        print("utils %-24s %.3f ms" % (name, (time.perf_counter() - start) / repeat * 1000.0))
+
+
+def run(frames_num=250, no_latency=False):
+    if no_latency:
+        fakesdk.configure({name: 0.0 for name in fakesdk.LATENCIES})
+    bench_pipeline(frames_num)
+    print("")
+    bench_analyze(frames_num)
+    print("")
+    bench_utils()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    run(*[int(arg) for arg in args], no_latency="--no-latency" in sys.argv)
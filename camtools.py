@@ -1,12 +1,18 @@
 import cv2
+import time
+import threading
+import collections
+import os.path as osp
 import utils
-from pyfacesdk import Image8U
 import config
+import frames
+from frames import Frame, FramePool
 
 
 class CamToolkit:
 
-	def __init__(self, source):
+	def __init__(self, source, threaded=None):
+		self.source = source
 		self.capture = cv2.VideoCapture(source)
 		self.fps = int(self.capture.get(cv2.CAP_PROP_FPS))
 		if self.fps == 0:
@@ -14,22 +20,300 @@ class CamToolkit:
 		self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
 		self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
 		self.scale_coef = config.video_scale
+		self.is_file = type(source) is str and osp.isfile(source)
+		self.decoder = FrameDecoder(
+			self.capture,
+			FramePool(config.capture_buffer_size + 4),
+			(self.height, self.width, 3),
+			self.is_file,
+			config.capture_decimation,
+			config.capture_time_step)
 
 		self.video_dict = {
 			"w": int(self.width*self.scale_coef),
 			"h": int(self.height*self.scale_coef),
 			"fps": self.fps,
-			"roi": None
+			"roi": config.video_roi
 		}
 
+		if threaded is None:
+			threaded = config.capture_threaded
+
+		self.reader = None
+		if threaded:
+			policy = config.capture_policy
+			if policy is None:
+				policy = CaptureReader.KEEP_ALL if self.is_file else CaptureReader.KEEP_LATEST
+			self.reader = CaptureReader(
+				self.decoder,
+				self.scale_coef,
+				config.capture_buffer_size,
+				policy,
+				self.fps)
+			self.reader.start()
+
+
+	def read_frame(self, scaled=True):
+		return self.decoder.read(self.scale_coef if scaled else 1.0)
+
+
+	def use_pool(self, pool):
+		'''
+			Frames are decoded into buffers of the pool
+			(frames.FramePool or framebus.FrameBus)
+		'''
+		self.decoder.pool = pool
+		self.decoder.decode_buffer = None
+
 
 	def get_frame(self, scaled=True):
-		status, frame = self.capture.read()
-		if float(self.scale_coef) != 1.0 and scaled:
-			frame = cv2.resize(frame, (0, 0), fx=self.scale_coef, fy=self.scale_coef)
-		return frame
+		'''
+			Returns the next frames.Frame or None when the stream is over.
+			Call frame.release() when the frame is not needed anymore,
+			so its buffer is reused
+		'''
+		if self.reader is None:
+			return self.read_frame(scaled)
+		return self.reader.get()
 
 	def get_frame_8u(self, scaled=True):
-		return Image8U(self.get_frame())
+		frame = self.get_frame(scaled)
+		if frame is None:
+			return None
+		return frame.image8u
+
+
+	def seek(self, timestamp):
+		'''
+			Moves a file source to the timestamp (ms).
+			Not available in the threaded mode
+		'''
+		self.decoder.seek(timestamp)
+
+
+	def stats(self):
+		stats = {"skipped": self.decoder.frames_skipped}
+		if not self.reader is None:
+			stats.update(self.reader.stats())
+		return stats
+
+
+	def release(self):
+		if not self.reader is None:
+			self.reader.stop()
+		self.capture.release()
+
+
+
+class FrameDecoder:
+	'''
+		Decodes and scales frames into pooled buffers.
+		The decode buffer of the scaled mode is reused as well,
+		so steady state reading allocates nothing.
+
+		Decimation: only frames which will be processed are decoded,
+		the others are only grabbed. With time_step (ms) for files
+		the decoder seeks by time when the step is long enough,
+		for live sources it grabs until time_step of wall time passed.
+		Otherwise every decimation-th frame is decoded.
+
+		Frame timestamps (ms) are the capture position for files
+		and wall time since the first frame for live sources.
+	'''
+
+	def __init__(self, capture, pool, shape, is_file=False, decimation=1, time_step=None):
+		self.capture = capture
+		self.pool = pool
+		self.shape = shape
+		self.decode_buffer = None
+
+		self.is_file = is_file
+		self.decimation = max(1, int(decimation))
+		self.time_step = time_step
+		self.next_time = None
+		self.last_timestamp = None
+		self.start_time = None
+		self.frames_skipped = 0
+
+
+	def position(self):
+		'''
+			Timestamp (ms) of the last grabbed frame
+		'''
+		if self.is_file:
+			return self.capture.get(cv2.CAP_PROP_POS_MSEC)
+		if self.start_time is None:
+			self.start_time = time.monotonic()
+		return (time.monotonic() - self.start_time) * 1000.0
+
+
+	def seek(self, timestamp):
+		'''
+			Moves a file source to the timestamp (ms)
+		'''
+		if self.is_file:
+			self.capture.set(cv2.CAP_PROP_POS_MSEC, timestamp)
+
+
+	def grab_next(self):
+		'''
+			Grabs the next frame to be decoded,
+			skipped frames are grabbed without decoding
+		'''
+		if self.time_step is None or self.next_time is None:
+			for _ in range(self.decimation - 1):
+				if not self.capture.grab():
+					return False
+				self.frames_skipped += 1
+			return self.capture.grab()
+
+		if self.is_file and self.time_step >= config.capture_seek_threshold:
+			self.seek(self.next_time)
+			return self.capture.grab()
+
+		while True:
+			if not self.capture.grab():
+				return False
+			if self.position() >= self.next_time:
+				return True
+			self.frames_skipped += 1
+
+
+	def read(self, scale_coef=1.0):
+		scale_coef = float(scale_coef)
+		if scale_coef == 1.0:
+			buf = self.pool.acquire(self.shape)
+		else:
+			if self.decode_buffer is None:
+				self.decode_buffer = self.pool.acquire(self.shape)
+			buf = self.decode_buffer
+
+		status = self.grab_next()
+		frame = None
+		if status:
+			status, frame = self.capture.retrieve(buf)
+		if not status or frame is None:
+			if scale_coef == 1.0:
+				self.pool.release(buf)
+			return None
+		capture_time = time.monotonic()
+
+		# Tracker needs strictly increasing timestamps
+		timestamp = self.position()
+		if not self.last_timestamp is None and timestamp <= self.last_timestamp:
+			timestamp = self.last_timestamp + 1
+		self.last_timestamp = timestamp
+		if not self.time_step is None:
+			self.next_time = timestamp + self.time_step
+
+		if not frame is buf:
+			# Decoder reallocated the buffer (unexpected frame size)
+			frames.stats["allocations"] += 1
+			self.shape = frame.shape
+			if scale_coef != 1.0:
+				self.decode_buffer = frame
+
+		if scale_coef != 1.0:
+			size = (int(frame.shape[1] * scale_coef), int(frame.shape[0] * scale_coef))
+			scaled = self.pool.acquire((size[1], size[0], 3))
+			cv2.resize(frame, size, dst=scaled)
+			frame = scaled
+		return Frame(frame, capture_time, self.pool, int(timestamp))
+
+
+class CaptureReader(threading.Thread):
+	'''
+		Reads, decodes and scales frames on a background thread
+		into a bounded ring buffer.
+
+		Policies:
+			KEEP_ALL - reader waits for free space, no frame is lost (files)
+			KEEP_LATEST - the oldest buffered frame is dropped (live cameras)
+
+		Buffer items are frames.Frame objects, their capture_time
+		is time.monotonic() of the moment the frame was decoded.
+		Late frames are counted only with KEEP_LATEST.
+	'''
+
+	KEEP_ALL = "all"
+	KEEP_LATEST = "latest"
+
+	def __init__(self, decoder, scale_coef, buffer_size, policy, fps):
+		threading.Thread.__init__(self, name="CaptureReader", daemon=True)
+		self.decoder = decoder
+		self.scale_coef = float(scale_coef)
+		self.buffer_size = max(1, buffer_size)
+		self.policy = policy
+		self.frame_period = 1.0 / fps if fps else 0.0
+
+		self.buffer = collections.deque()
+		self.cond = threading.Condition()
+		self.stopped = False
+		self.eof = False
+
+		self.frames_read = 0
+		self.frames_dropped = 0
+		self.frames_late = 0
+
+
+	def run(self):
+		while not self.stopped:
+			frame = self.decoder.read(self.scale_coef)
+			if frame is None:
+				break
+			self.put(frame)
+
+		with self.cond:
+			self.eof = True
+			self.cond.notify_all()
+
+
+	def put(self, item):
+		with self.cond:
+			if self.policy == self.KEEP_ALL:
+				while len(self.buffer) >= self.buffer_size and not self.stopped:
+					self.cond.wait()
+			elif len(self.buffer) >= self.buffer_size:
+				self.buffer.popleft().release()
+				self.frames_dropped += 1
+			self.buffer.append(item)
+			self.frames_read += 1
+			self.cond.notify_all()
+
+
+	def get(self, timeout=None):
+		'''
+			Returns the next frame or None at the end of stream
+		'''
+		with self.cond:
+			while not self.buffer:
+				if self.eof or self.stopped:
+					return None
+				if not self.cond.wait(timeout):
+					return None
+			item = self.buffer.popleft()
+			self.cond.notify_all()
+
+		# Live frame is late if it waited in the buffer longer than
+		# one frame period, files are decoded ahead by design
+		if self.policy == self.KEEP_LATEST and self.frame_period \
+				and time.monotonic() - item.capture_time > self.frame_period:
+			self.frames_late += 1
+		return item
+
+
+	def stop(self):
+		with self.cond:
+			self.stopped = True
+			self.cond.notify_all()
+		self.join(timeout=1.0)
 
 
+	def stats(self):
+		with self.cond:
+			return {
+				"read": self.frames_read,
+				"dropped": self.frames_dropped,
+				"late": self.frames_late,
+				"buffered": len(self.buffer)
+			}
@@ -0,0 +1,105 @@
+import numpy as np
+
+import config
+import utils
+
+
+class OverlayCompositor:
+    '''
+        Composes the output image: info panel on the left,
+        annotated frame on the right.
+
+        Owns one preallocated canvas, the frame and the panel
+        are views of it, so nothing is allocated per frame.
+        Text blocks are rendered once per tracklet and rendered
+        again only when their lines change.
+
+        Usage:
+            view = compositor.begin(frame)
+            utils.draw_tracklet_on_frame(view, tlet, ...)
+            compositor.draw_panel([(tlet.id, lines_dict), ...])
+            cv2.imshow(win_name, compositor.canvas)
+    '''
+
+    def __init__(self, panel_ratio=None):
+        if panel_ratio is None:
+            panel_ratio = config.info_panel_ratio
+        self.panel_ratio = panel_ratio
+        self.canvas = None
+        self.blocks = {}
+        self.layout = None
+        self.rendered = 0
+
+
+    def allocate(self, frame_h, frame_w):
+        panel_w = int(frame_w * self.panel_ratio)
+        self.canvas = np.zeros((frame_h, panel_w + frame_w, 3), np.uint8)
+        self.panel = self.canvas[:, :panel_w]
+        self.frame_view = self.canvas[:, panel_w:]
+        self.blocks = {}
+        self.layout = None
+
+
+    def begin(self, frame):
+        '''
+            Copies the frame into the canvas and returns
+            the frame view to draw tracklets on
+        '''
+        if self.canvas is None or self.frame_view.shape != frame.shape:
+            self.allocate(frame.shape[0], frame.shape[1])
+        np.copyto(self.frame_view, frame)
+        return self.frame_view
+
+
+    def block(self, tlet_id, lines_dict):
+        '''
+            Returns rendered text block of the tracklet,
+            renders it only if the lines were changed
+        '''
+        key = tuple((k, str(v)) for k, v in lines_dict.items())
+        cached = self.blocks.get(tlet_id)
+        if not cached is None and cached[0] == key:
+            return cached
+
+        line_h = config.font_size + config.space_between_text_line
+        block_h = 2 * config.info_panel_padding + line_h * (len(lines_dict) - 1)
+        block = utils.create_blank_image(block_h, self.panel.shape[1])
+        block = utils.put_text_from_dict_on_image(block, lines_dict, "left-top")
+        # Serial number of rendering identifies the block in the layout
+        self.rendered += 1
+        self.blocks[tlet_id] = (key, block, self.rendered)
+        return self.blocks[tlet_id]
+
+
+    def draw_panel(self, items):
+        '''
+            Stacks text blocks of the tracklets on the panel
+            from top to bottom, blocks which don't fit are skipped.
+
+            argument items:
+                - list of (tracklet_id, lines_dict)
+        '''
+        blocks = [self.block(tlet_id, lines_dict) for tlet_id, lines_dict in items]
+
+        # Blocks of tracklets which are not shown anymore
+        shown = set(tlet_id for tlet_id, _ in items)
+        for tlet_id in list(self.blocks):
+            if not tlet_id in shown:
+                del self.blocks[tlet_id]
+
+        # Nothing changed since the last frame - panel is already drawn
+        layout = [serial for _, _, serial in blocks]
+        if layout == self.layout:
+            return self.canvas
+        self.layout = layout
+
+        self.panel[:] = 0
+        y = 0
+        panel_h = self.panel.shape[0]
+        for _, block, _ in blocks:
+            block_h = block.shape[0]
+            if y + block_h > panel_h:
+                break
+            self.panel[y:y + block_h] = block
+            y += block_h
+        return self.canvas
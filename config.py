@@ -11,11 +11,65 @@ app_name = "Face recognizer"
 debug_mode = True
 
 
-# Path to log file
+# Path to log file (see logger.py)
 log_file = "./log_ex.log"
-
+# True - all records are also written to log_file as JSON lines
+log_to_file = False
+# None - DEBUG if debug_mode else INFO
+log_level = None
+# Log file is rotated when it grows to log_max_bytes
+log_max_bytes = 10 * 1024 * 1024
+log_backups = 5
+# Not more than log_rate_limit records with the same
+# message (or key) are written every log_rate_interval seconds
+log_rate_limit = 20
+log_rate_interval = 10.0
+# Records waiting for the writer thread, when the queue is
+# full new records are dropped (counted in records_dropped)
+log_queue_size = 10000
+
+# Headless mode: no GUI windows and drawing, frames are
+# processed as fast as possible (also enabled by --headless).
+# Results are written as JSON lines, "-" means stdout
+# (console log goes to stderr then)
+headless = False
+results_file = "./results.jsonl"
+
+# Batch processing of recorded videos (see batch.py).
+# batch_jobs = None - one worker process per CPU
+batch_output_dir = "./batch_results"
+batch_jobs = None
+# OpenCV threads of every batch worker (decode, resize),
+# workers already use all cores together
+batch_cv_threads = 1
+
+# Per-stage latency histograms (see timing.py).
+# Summary is logged and written to timing_report_path
+# every timing_report_interval seconds
+timing_enabled = True
+timing_report_interval = 60.0
+timing_report_path = "./timings.json"
+
+# Shared memory frame bus (see framebus.py, also enabled by --bus):
+# capture, tracking, rendering and recording run in separate processes
+frame_bus = False
+frame_bus_slots = 16
+# Seconds the capture waits for a free slot before giving up
+frame_bus_timeout = 10.0
+
+# Annotated frames video log (see videolog.py),
+# frames are encoded on a background thread
 write_videolog = False
 videolog_filename = "out_videolog.avi"
+videolog_fourcc = "MJPG"
+videolog_queue_size = 32
+# "oldest" - drop the oldest queued frame when the encoder falls behind
+# "newest" - drop the new frame
+videolog_drop_policy = "oldest"
+# A new segment file is started after N seconds or bytes,
+# None disables the limit (both None - one file videolog_filename)
+videolog_segment_duration = 600
+videolog_segment_size = None
 
 
 # ======================
@@ -28,6 +82,15 @@ descriptors_dir = osp.join(base_dir, "storage/descriptors/")
 photos_dir = osp.join(base_dir, "storage/photos/")
 bestframes_dir = osp.join(base_dir, "storage/bestframes/")
 
+# Packed descriptors gallery (see descstore.py)
+gallery_matrix_path = osp.join(base_dir, "storage/gallery.bin")
+gallery_index_path = osp.join(base_dir, "storage/gallery.index")
+
+# Bulk enrollment of photos_dir (see enroll.py),
+# None - one process per CPU core
+enroll_jobs = None
+enroll_min_face_size = 40
+
 
 # Filenames patterns: 
 #   - photo: <id><n>.jpg
@@ -50,11 +113,48 @@ video_scale = 1.0
 video_source = 0
 # video_source = "./test_videos/600.part4.mkv"
 
+# Region of interest (x, y, w, h) in scaled frame coordinates
+# None - full frame
+video_roi = None
+
+# Tracker works on the ROI crop downscaled by tracker_input_scale,
+# classifiers get full resolution crops of the faces.
+# Absolute det_minsize / det_maxsize are in the tracker input coordinates
+tracker_preprocess = True
+tracker_input_scale = 1.0
+
+
+# Decimation: only every capture_decimation-th frame is decoded.
+# If capture_time_step (ms) is set, frames are decoded once per
+# this interval of the stream time instead. Video files are
+# seeked when the step is not less than capture_seek_threshold ms
+capture_decimation = 1
+capture_time_step = None
+capture_seek_threshold = 2000
+
+# Decode and scale frames on a background thread
+capture_threaded = False
+# Ring buffer size (frames)
+capture_buffer_size = 8
+# "all" - keep every frame (video files)
+# "latest" - drop the oldest frames (live cameras)
+# None - choose by the source type
+capture_policy = None
+
 
 # =======================
 # FaceSDK settings      |
 # =======================
 
+# "pyfacesdk" - Tevian FaceSDK, "fake" - stand-in from fakesdk.py
+# (FACESDK_BACKEND environment variable overrides it)
+sdk_backend = "pyfacesdk"
+
+# Models are loaded on the first use, warm-up loads the models
+# used with the current settings at startup and runs a dummy
+# inference, so the first frames are not slowed down
+models_warm_up = True
+
 global_tracker_max_lost_time = 1000
 # detector_confidence = 0.2
 # detection_filter_confidence = 0.5
@@ -84,14 +184,132 @@ tracker_matching_threshold = 0.4
 
 detector_precision_level = 0.6
 
+# Minimal average matching score to recognize a person
+recognition_threshold = 0.65
+# Number of persons shortlisted by the gallery index
+# and scored by the FaceSDK matcher
+recognition_shortlist = 10
+
+
+# =======================
+# Results cache settings|
+# =======================
+
+# Attributes and demographics are classified until
+# the most common value of every field has at least
+# cache_stable_agreement share of cache_stable_samples votes.
+# After cache_stable_max_samples votes they are frozen anyway
+cache_stable_samples = 5
+cache_stable_agreement = 0.6
+cache_stable_max_samples = 15
+
+# Emotion is refreshed once per this interval (ms)
+cache_emotion_refresh_interval = 500
+
+
+# Load governor (see governor.py) keeps live processing
+# real-time by adjusting the knobs below within their bounds.
+# Load is the smoothed frame time relative to the frame budget
+governor_enabled = True
+governor_smoothing = 0.1
+governor_adjust_every = 25
+governor_high_load = 0.9
+governor_low_load = 0.5
+governor_max_emotion_interval = 4000
+governor_max_detection_period = 40
+governor_detection_period_step = 5
+governor_max_frame_skip = 3
+
+
+# Deadline scheduler (see scheduler.py). A frame of a live source
+# must be shown within scheduler_max_latency ms after capture,
+# frames which would miss the deadline are dropped before tracking,
+# but not more than scheduler_max_dropped frames in a row
+scheduler_enabled = True
+scheduler_max_latency = 200
+scheduler_max_dropped = 5
+scheduler_smoothing = 0.1
+
+
+# Classify faces only on frames passing the quality checks
+# (see quality.py). Attributes and demographics are classified
+# only on the quality_best_frames_num best frames of a tracklet
+quality_gate = True
+quality_best_frames_num = 4
+quality_max_blurriness = 0.6
+quality_max_yaw = 30
+quality_max_pitch = 20
+quality_min_resolution = 40
+
+
+# Classify faces on a pool of worker threads
+# instead of the frame loop (see workers.py)
+async_classifiers = False
+classifier_workers = 2
+classifier_queue_size = 16
+# Face crops are extended by this part of the face size
+classifier_crop_margin = 0.5
+
 
 
 # =======================
 # Draw settings         |
 # =======================
 
+# Info panel width relative to the frame width
+info_panel_ratio = 0.4
 info_panel_padding = 20
 space_between_text_line = 8
 font_size = 12
 font_thickness = 1
-font_color = (220, 220, 220)
\ No newline at end of file
+font_color = (220, 220, 220)
+
+
+
+# =======================
+# Visits settings       |
+# =======================
+
+# Visits counting (see visits.py).
+# Finished tracklets longer than visit_min_duration ms
+# are written to the append-only journal
+count_visits = True
+camera_name = "cam0"
+visit_min_duration = 1000
+visits_journal_path = osp.join(base_dir, "storage/visits.jsonl")
+visits_batch_size = 256
+# Seconds between fsync calls
+visits_fsync_interval = 1.0
+# Counters snapshot is saved every N events
+visits_snapshot_every = 10000
+
+
+# Re-identification of returning visitors (see reid.py).
+# Descriptor of the best frame of a finished tracklet is matched
+# against visitors seen during the last reid_max_age seconds
+reid_enabled = True
+reid_capacity = 50000
+reid_max_age = 24 * 3600
+# Minimal FaceSDK matcher score of a returning visitor
+reid_threshold = 0.65
+# Number of visitors shortlisted by the gallery matrix
+# and scored by the FaceSDK matcher
+reid_shortlist = 5
+# Weight of the new descriptor in the visitor's moving average
+reid_update_rate = 0.2
+
+
+# =======================
+# Supervisor settings   |
+# =======================
+
+# Cameras processed by supervisor.py, one worker process per camera:
+#   {"name": "entrance1", "source": "rtsp://...", "cpus": [0, 1]}
+# "cpus" is optional and pins the worker to the given cores,
+# "results_file" is optional, by default results are not written
+video_sources = []
+# Seconds to wait before a crashed worker is restarted
+supervisor_restart_delay = 5.0
+# None - crashed workers are restarted forever
+supervisor_max_restarts = None
+supervisor_report_interval = 60.0
@@ -0,0 +1,246 @@
+import json
+import os
+import os.path as osp
+import sys
+
+import numpy as np
+
+import config
+import utils
+from gallery import GalleryIndex, descriptors2vectors
+
+
+class DescriptorStore:
+    '''
+        Packed on-disk gallery of descriptors.
+
+        Consists of two files:
+            - matrix file: raw uint8 descriptors, one fixed-width row each
+            - index file: JSON lines. First line is a header
+                {"descriptor_size": D}, then one line per matrix row
+                {"row": n, "id": person_id, "name": person_name}
+                (person ids are stored as strings)
+                ("hash" of the source photo is added by enroll.py)
+
+        The matrix is memory-mapped on load, new persons are
+        appended to both files without rewriting them.
+        Normalized float32 vectors used by the gallery index are
+        cached next to the matrix (matrix path + ".vectors.npy")
+        and memory-mapped too.
+    '''
+
+    # Rows converted at once when the vectors file is built
+    VECTORS_CHUNK = 65536
+
+    def __init__(self, matrix_path=None, index_path=None):
+        self.matrix_path = matrix_path or config.gallery_matrix_path
+        self.index_path = index_path or config.gallery_index_path
+        self.vectors_path = self.matrix_path + ".vectors.npy"
+        self.descriptor_size = None
+        self.entries = []
+
+
+    def exists(self):
+        return osp.isfile(self.matrix_path) and osp.isfile(self.index_path)
+
+
+    def read_index(self):
+        self.entries = []
+        with open(self.index_path, 'r') as index_file:
+            header = json.loads(index_file.readline())
+            self.descriptor_size = header["descriptor_size"]
+            for line in index_file:
+                line = line.strip()
+                if line:
+                    self.entries.append(json.loads(line))
+        return self.entries
+
+
+    def load(self):
+        '''
+            Returns (matrix, entries) where matrix is a
+            read-only memory-mapped uint8 array (rows, descriptor_size)
+        '''
+        self.read_index()
+        rows = len(self.entries)
+        if rows == 0:
+            return np.zeros((0, self.descriptor_size), np.uint8), self.entries
+
+        # Rows written after the last index line (interrupted append)
+        # are not referenced and are ignored
+        stored_rows = osp.getsize(self.matrix_path) // self.descriptor_size
+        rows = min(rows, stored_rows)
+        self.entries = self.entries[:rows]
+        matrix = np.memmap(
+            self.matrix_path,
+            dtype=np.uint8,
+            mode='r',
+            shape=(rows, self.descriptor_size))
+        return matrix, self.entries
+
+
+    def append(self, persons):
+        '''
+            Appends persons to the store.
+
+            argument persons:
+                - list of (person_id, name, descriptors) or
+                  (person_id, name, descriptors, hashes)
+                  where descriptors is a list of uint8 arrays or lists
+                  and hashes - content hashes of the source photos
+        '''
+        rows = []
+        hashes = []
+        for person in persons:
+            pers_id, name, descriptors = person[:3]
+            # persons.json ids are numbers, photo directory ids strings,
+            # so the same person is never stored under two ids
+            pers_id = str(pers_id)
+            for n, desc in enumerate(descriptors):
+                rows.append((pers_id, name, np.asarray(desc, np.uint8).ravel()))
+                hashes.append(person[3][n] if len(person) > 3 else None)
+        if not rows:
+            return 0
+
+        if self.exists():
+            self.read_index()
+        else:
+            self.descriptor_size = rows[0][2].shape[0]
+            self.entries = []
+            with open(self.index_path, 'w') as index_file:
+                index_file.write(json.dumps({"descriptor_size": self.descriptor_size}) + "\n")
+            open(self.matrix_path, 'wb').close()
+
+        for pers_id, name, desc in rows:
+            if desc.shape[0] != self.descriptor_size:
+                raise ValueError(
+                    "Descriptor of person %s has size %d, store expects %d" %
+                    (str(pers_id), desc.shape[0], self.descriptor_size))
+
+        # Matrix is written first, so an interrupted append
+        # never leaves index lines without descriptors
+        first_row = len(self.entries)
+        with open(self.matrix_path, 'r+b') as matrix_file:
+            matrix_file.seek(first_row * self.descriptor_size)
+            for _, _, desc in rows:
+                matrix_file.write(desc.tobytes())
+            matrix_file.truncate()
+            matrix_file.flush()
+            os.fsync(matrix_file.fileno())
+
+        with open(self.index_path, 'a') as index_file:
+            for n, (pers_id, name, _) in enumerate(rows):
+                entry = {"row": first_row + n, "id": pers_id, "name": name}
+                if not hashes[n] is None:
+                    entry["hash"] = hashes[n]
+                self.entries.append(entry)
+                index_file.write(json.dumps(entry) + "\n")
+        return len(rows)
+
+
+    def hashes(self):
+        '''
+            Returns the set of content hashes of enrolled photos
+        '''
+        if not self.exists():
+            return set()
+        return set(entry["hash"] for entry in self.read_index() if "hash" in entry)
+
+
+    def load_vectors(self, matrix):
+        '''
+            Returns read-only memory-mapped vectors of the matrix rows
+            (see gallery.descriptors2vectors). The vectors file is
+            rebuilt chunk by chunk when it is missing or older than
+            the matrix, the whole gallery is never converted in RAM.
+        '''
+        rows = matrix.shape[0]
+        if rows == 0:
+            return descriptors2vectors(matrix)
+        if osp.isfile(self.vectors_path) \
+                and osp.getmtime(self.vectors_path) >= osp.getmtime(self.matrix_path):
+            vectors = np.load(self.vectors_path, mmap_mode='r')
+            if vectors.shape == matrix.shape:
+                return vectors
+
+        # Written aside, so readers never map a half-built file
+        tmp_path = "%s.%d.tmp.npy" % (self.vectors_path, os.getpid())
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float32, shape=matrix.shape)
+        for start in range(0, rows, self.VECTORS_CHUNK):
+            end = start + self.VECTORS_CHUNK
+            vectors[start:end] = descriptors2vectors(matrix[start:end])
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+        return np.load(self.vectors_path, mmap_mode='r')
+
+
+    def gallery_index(self):
+        '''
+            Builds gallery.GalleryIndex from the stored descriptors,
+            both descriptors and vectors are memory-mapped
+        '''
+        matrix, entries = self.load()
+        person_rows = []
+        ids, names = [], []
+        rows_by_id = {}
+        for entry in entries:
+            # Stores written before ids were normalized have numbers too
+            pers_id = str(entry["id"])
+            if not pers_id in rows_by_id:
+                rows_by_id[pers_id] = len(ids)
+                ids.append(pers_id)
+                names.append(entry["name"])
+            person_rows.append(rows_by_id[pers_id])
+        return GalleryIndex(
+            matrix, np.array(person_rows, np.int64), ids, names, self.load_vectors(matrix))
+
+
+def load_gallery():
+    '''
+        Returns GalleryIndex from the packed store or,
+        if it was not migrated yet, from the storage/ JSON layout
+    '''
+    store = DescriptorStore()
+    if store.exists():
+        index = store.gallery_index()
+        utils.log("Gallery loaded from %s: %d persons" % (store.matrix_path, len(index)))
+        return index
+    utils.log("Packed gallery not found, reading %s" % config.persons_json_path)
+    return GalleryIndex.from_persons_data(utils.read_persons_data())
+
+
+def migrate(persons_json_path=None, descriptors_dir=None, store=None):
+    '''
+        One-shot migration from storage/persons.json and
+        per-person JSON .descriptor files to the packed store
+    '''
+    persons_json_path = persons_json_path or config.persons_json_path
+    descriptors_dir = descriptors_dir or config.descriptors_dir
+    store = store or DescriptorStore()
+    if store.exists():
+        utils.log("Packed gallery already exists: %s" % store.matrix_path)
+        return 0
+
+    with open(persons_json_path, 'r') as persons_file:
+        persons_data = json.load(persons_file)
+
+    persons = []
+    for pers in persons_data["persons"]:
+        descriptors_filename = osp.join(descriptors_dir, "%s.descriptor" % pers["id"])
+        with open(descriptors_filename, 'r') as descriptors_file:
+            descriptors_data = json.load(descriptors_file)
+        persons.append((pers["id"], pers["name"], descriptors_data["descriptors"]))
+
+    rows = store.append(persons)
+    utils.log("Migrated %d persons (%d descriptors) to %s" %
+        (len(persons), rows, store.matrix_path))
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate()
+    else:
+        print("Usage: python descstore.py migrate")
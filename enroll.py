@@ -0,0 +1,193 @@
+'''
+    Bulk enrollment of persons photos into the packed gallery.
+
+    Photos layout: <photos_dir>/<person_id>/<photo>, photos placed
+    directly in photos_dir are enrolled with the file name as person id.
+    Person names are taken from persons.json if it exists.
+
+    Photos are processed on a process pool (detection, points and
+    descriptor extraction), photos already enrolled are skipped by
+    the content hash, all new descriptors are appended to the
+    gallery (descstore.DescriptorStore) in one pass.
+    With --rebuild (e.g. after a model upgrade) all photos are
+    enrolled again and the gallery is replaced.
+
+    Usage:
+        python enroll.py [-j JOBS] [--rebuild] [PHOTOS_DIR]
+'''
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path as osp
+import time
+
+import config
+
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def find_photos(photos_dir):
+    '''
+        Returns list of (person_id, photo_path)
+    '''
+    photos = []
+    for root, dirs, files in os.walk(photos_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.lower().endswith(PHOTO_EXTENSIONS):
+                continue
+            path = osp.join(root, filename)
+            if osp.abspath(root) == osp.abspath(photos_dir):
+                person_id = osp.splitext(filename)[0]
+            else:
+                person_id = osp.relpath(root, photos_dir).split(os.sep)[0]
+            photos.append((person_id, path))
+    return photos
+
+
+def file_hash(path):
+    with open(path, 'rb') as photo_file:
+        return hashlib.sha1(photo_file.read()).hexdigest()
+
+
+def read_names():
+    if not osp.isfile(config.persons_json_path):
+        return {}
+    with open(config.persons_json_path, 'r') as persons_file:
+        persons_data = json.load(persons_file)
+    return {str(pers["id"]): pers["name"] for pers in persons_data["persons"]}
+
+
+# ==========================================================
+# WORKER PROCESS
+
+# SDK objects of the worker process, see init_worker()
+worker_models = None
+
+
+def init_worker():
+    global worker_models
+    from sdk import IDetector, IPointsDetector, IExtractor
+    worker_models = (IDetector(), IPointsDetector(), IExtractor())
+
+
+def enroll_photo(args):
+    '''
+        Returns (person_id, hash, descriptor bytes or None, error)
+    '''
+    person_id, path, photo_hash = args
+    import cv2
+    import utils
+    from sdk import URect, USize
+
+    img = cv2.imread(path)
+    if img is None:
+        return person_id, photo_hash, None, "can't read image"
+
+    detector, points_detector, extractor = worker_models
+    img8u = utils.to_image8u(img)
+    h, w = img.shape[:2]
+    min_size = min(config.enroll_min_face_size, w, h)
+    faces = detector.detect(
+        img8u,
+        URect(0, 0, w, h),
+        USize(min_size, min_size),
+        USize(w, h),
+        config.detector_precision_level)
+    if not faces:
+        return person_id, photo_hash, None, "no face found"
+
+    # The largest face is the enrolled person
+    facerect = max(faces, key=lambda rect: rect.w * rect.h)
+    points = points_detector.detectFromBbox(img8u, facerect)
+    descriptor = extractor.enroll(img8u, points)
+    return person_id, photo_hash, utils.desc2array(descriptor).tobytes(), None
+
+
+# ==========================================================
+
+
+def run(photos_dir, jobs, rebuild=False):
+    import numpy as np
+    import utils
+    from descstore import DescriptorStore
+
+    store = DescriptorStore()
+    if rebuild:
+        # New gallery is written aside and replaces the old one when done
+        store = DescriptorStore(
+            config.gallery_matrix_path + ".new",
+            config.gallery_index_path + ".new")
+        for path in (store.matrix_path, store.index_path):
+            if osp.isfile(path):
+                os.remove(path)
+
+    photos = find_photos(photos_dir)
+    enrolled = store.hashes()
+    todo = []
+    for person_id, path in photos:
+        photo_hash = file_hash(path)
+        if not photo_hash in enrolled:
+            # Duplicated photos are enrolled once
+            enrolled.add(photo_hash)
+            todo.append((person_id, path, photo_hash))
+    utils.log("Photos: %d, already enrolled: %d, to enroll: %d" % (
+        len(photos), len(photos) - len(todo), len(todo)))
+
+    start = time.time()
+    persons = {}
+    failed = 0
+    if todo:
+        pool = multiprocessing.Pool(jobs, initializer=init_worker)
+        try:
+            chunksize = max(1, min(64, len(todo) // (jobs * 4)))
+            for person_id, photo_hash, descriptor, error in pool.imap_unordered(
+                    enroll_photo, todo, chunksize):
+                if descriptor is None:
+                    failed += 1
+                    utils.log("Photo of %s is not enrolled: %s" % (person_id, error),
+                        key="enroll_failed")
+                    continue
+                descriptors, hashes = persons.setdefault(person_id, ([], []))
+                descriptors.append(np.frombuffer(descriptor, np.uint8))
+                hashes.append(photo_hash)
+        finally:
+            pool.close()
+            pool.join()
+
+    names = read_names()
+    rows = store.append([
+        (person_id, names.get(person_id, person_id), descriptors, hashes)
+        for person_id, (descriptors, hashes) in sorted(persons.items())])
+
+    if rebuild:
+        if not store.exists():
+            utils.log("No photos enrolled, the gallery is not replaced")
+            return 0
+        os.replace(store.matrix_path, config.gallery_matrix_path)
+        os.replace(store.index_path, config.gallery_index_path)
+        vectors_path = DescriptorStore().vectors_path
+        if osp.isfile(vectors_path):
+            os.remove(vectors_path)
+
+    elapsed = time.time() - start
+    utils.log("Enrolled %d photos of %d persons (%d failed) in %.1f s (%.1f photos/s)" % (
+        rows, len(persons), failed, elapsed, rows / max(elapsed, 1e-6)))
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk enrollment of persons photos")
+    parser.add_argument("photos_dir", nargs="?", default=config.photos_dir)
+    parser.add_argument("-j", "--jobs", type=int, default=config.enroll_jobs or os.cpu_count())
+    parser.add_argument("--rebuild", action="store_true",
+        help="enroll all photos again and replace the gallery (after a model upgrade)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.photos_dir, args.jobs, args.rebuild)
@@ -1,8 +1,47 @@
 import cv2
 import config
 import numpy as np
-from pyfacesdk import *
+from sdk import *
 import utils
+import timing
+import frames
+from gallery import GalleryIndex
+from quality import BestFrames, quality_score
+from preproc import FramePreprocessor
+from collections import Counter
+import threading
+import time
+from workers import ClassifierPool, VisitWorker
+
+
+class lazy_model:
+    '''
+        FaceToolkit attribute which creates the SDK object on
+        the first access and records its load time.
+        The object is stored in the instance dict, so later
+        accesses do not go through the descriptor at all.
+    '''
+
+    lock = threading.Lock()
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        with self.lock:
+            model = obj.__dict__.get(self.name)
+            if model is None:
+                start = time.perf_counter()
+                model = self.factory(obj)
+                load_ms = (time.perf_counter() - start) * 1000.0
+                obj.model_times[self.name] = load_ms
+                obj.__dict__[self.name] = model
+                utils.log("Model %s loaded in %.1f ms" % (self.name, load_ms), offset=1)
+        return model
 
 
 class FaceToolkit:
@@ -26,6 +65,18 @@ class FaceToolkit:
         utils.log("-" * 30)
         utils.log("Start initializing FaceSDK toolkit container:")
 
+        # Tracker works on the ROI crop downscaled by
+        # config.tracker_input_scale, tracker parameters
+        # are set in its coordinates
+        self.preprocessor = None
+        if config.tracker_preprocess:
+            self.preprocessor = FramePreprocessor(video_params)
+            if self.preprocessor.is_identity():
+                self.preprocessor = None
+            else:
+                video_params = self.preprocessor.tracker_video_dict()
+                utils.log("Tracker input is %d x %d" % (video_params["w"], video_params["h"]), offset=1)
+
         self.video = video_params
         self.vw = self.video["w"]
         self.vh = self.video["h"]
@@ -38,39 +89,221 @@ class FaceToolkit:
         self.roi = URect(r_x, r_y, r_w, r_h)
         self.minsize = USize(d_min_w, d_min_h)
         self.maxsize = USize(d_max_w, d_max_h)
-        self.g_tracker = IGlobalTracker()
 
-        # Set Global tracker parameters:     
-        self.g_tracker.maxFaceSize = self.maxsize
-        self.g_tracker.minFaceSize = self.minsize
-        self.g_tracker.roi = self.roi
-        self.g_tracker.maxLostTime = config.tracker_max_lost_time
-        self.g_tracker.bestFaceScale = config.tracker_best_face_scale
-        self.g_tracker.bestFramesNum = config.tracker_best_frames_num
-        self.g_tracker.detectionAlg = DETECTOR_TYPE.ALG1
-        self.g_tracker.detectionFilter = config.tracker_detection_filter
-        self.g_tracker.detectionFilterThr = config.tracker_detection_filter_threshold
-        self.g_tracker.detectionPeriod = config.tracker_detection_period
-        self.g_tracker.detectionThr = config.tracker_detection_threshold
-        self.g_tracker.favorLongTracks = config.tracker_favor_long_tracks
-        self.g_tracker.matchThr = config.tracker_matching_thresholder
-        self.g_tracker.trackingThr = config.tracker_matching_threshold
-        # -----------------------------
+        # Other models are created on the first use (see lazy_model),
+        # load and warm-up times are reported by model_report()
+        self.model_times = {}
+        self.warm_up_times = {}
+        start = time.perf_counter()
+        self.g_tracker = self.create_tracker()
+        self.model_times["g_tracker"] = (time.perf_counter() - start) * 1000.0
 
         self.precision_level = config.detector_precision_level
-        self.points_detector = IPointsDetector()
-        self.extractor = IExtractor()
-        self.detector = IDetector()
-        self.matcher = IMatcher()
 
-        self.quality_evaluator = IQualityEvaluator()
-        self.quality_evaluator.config.blurrines = True;
-        self.quality_evaluator.config.angles = True;
-        self.quality_evaluator.config.resolution =  True;
+        self.results_cache = TrackletResultsCache(
+            config.tracker_max_lost_time,
+            config.cache_emotion_refresh_interval)
+
+        # Best frames crops are kept only for descriptors of visits:
+        # re-identification or known persons (set by the caller
+        # which passes a known persons gallery to record_visits)
+        self.keep_best_crops = config.count_visits and config.reid_enabled
+
+        # Created on the first analyze_async() call or by warm_up()
+        self.classifier_pool = None
+        # Created on the first identified visit or by warm_up()
+        self.visit_worker = None
+
+        # Results entries of tracklets dropped by the tracker,
+        # see pop_finished()
+        self.finished = []
+
+        # (persons data, index) of the last persons data passed
+        # to recognize_person, the index is built only once
+        self.dataset_index = None
+
+
+    @lazy_model
+    def points_detector(self):
+        return IPointsDetector()
+
+
+    @lazy_model
+    def extractor(self):
+        return IExtractor()
+
+
+    @lazy_model
+    def detector(self):
+        return IDetector()
+
+
+    @lazy_model
+    def matcher(self):
+        return IMatcher()
+
+
+    @lazy_model
+    def quality_evaluator(self):
+        quality_evaluator = IQualityEvaluator()
+        quality_evaluator.config.blurrines = True;
+        quality_evaluator.config.angles = True;
+        quality_evaluator.config.resolution =  True;
+        return quality_evaluator
+
+
+    @lazy_model
+    def attr_classifier(self):
+        return IAttributes()
+
+
+    @lazy_model
+    def demo_classifier(self):
+        return IDemographics()
+
+
+    @lazy_model
+    def emo_classifier(self):
+        return IEmotions()
 
-        self.attr_classifier = IAttributes()
-        self.demo_classifier = IDemographics()
-        self.emo_classifier = IEmotions()
+
+    def warm_up(self):
+        '''
+            Loads the models used by the pipeline with the current
+            config and runs a dummy inference on a blank image,
+            so the first real frame does not pay first-call latency.
+            The tracker keeps state between frames, so it is only created.
+        '''
+        img8u = utils.to_image8u(utils.create_blank_image(128, 128))
+        facerect = utils.img2irect(img8u)
+        points = self.warm_up_model("points_detector", self.get_points, img8u, facerect)
+
+        if config.quality_gate:
+            self.warm_up_model("quality_evaluator", self.evaluate_quality, img8u, facerect)
+
+        if config.async_classifiers:
+            # Every worker creates its own classifiers
+            self.get_classifier_pool()
+        elif not points is None:
+            self.warm_up_model("attr_classifier", self.classify_attributes, img8u, points)
+            self.warm_up_model("demo_classifier", self.classify_demographics, img8u, points)
+            self.warm_up_model("emo_classifier", self.classify_emotion, img8u, points)
+
+        if config.count_visits and config.reid_enabled:
+            # Descriptors are extracted by the visit worker
+            self.get_visit_worker()
+
+
+    def warm_up_model(self, name, func, *args):
+        # Model is loaded before the timed call
+        getattr(self, name)
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            utils.log("Warm-up of %s failed: %s" % (name, str(e)), offset=1)
+            return None
+        self.warm_up_times[name] = (time.perf_counter() - start) * 1000.0
+        return result
+
+
+    def model_report(self):
+        utils.log("Models startup (ms):")
+        for name, load_ms in sorted(self.model_times.items()):
+            utils.log("%-20s load %8.1f  warm-up %8s" % (
+                name, load_ms,
+                "%.1f" % self.warm_up_times[name] if name in self.warm_up_times else "-"),
+                offset=1)
+
+
+    def get_classifier_pool(self):
+        if self.classifier_pool is None:
+            start = time.perf_counter()
+            self.classifier_pool = ClassifierPool(
+                config.classifier_workers,
+                config.classifier_queue_size)
+            self.model_times["classifier_pool"] = (time.perf_counter() - start) * 1000.0
+        return self.classifier_pool
+
+
+    def get_visit_worker(self):
+        if self.visit_worker is None:
+            start = time.perf_counter()
+            self.visit_worker = VisitWorker()
+            self.visit_worker.start()
+            self.model_times["visit_worker"] = (time.perf_counter() - start) * 1000.0
+        return self.visit_worker
+
+
+    def create_tracker(self):
+        g_tracker = IGlobalTracker()
+
+        # Set Global tracker parameters:     
+        g_tracker.maxFaceSize = self.maxsize
+        g_tracker.minFaceSize = self.minsize
+        g_tracker.roi = self.roi
+        g_tracker.maxLostTime = config.tracker_max_lost_time
+        g_tracker.bestFaceScale = config.tracker_best_face_scale
+        g_tracker.bestFramesNum = config.tracker_best_frames_num
+        g_tracker.detectionAlg = DETECTOR_TYPE.ALG1
+        g_tracker.detectionFilter = config.tracker_detection_filter
+        g_tracker.detectionFilterThr = config.tracker_detection_filter_threshold
+        g_tracker.detectionPeriod = config.tracker_detection_period
+        g_tracker.detectionThr = config.tracker_detection_threshold
+        g_tracker.favorLongTracks = config.tracker_favor_long_tracks
+        g_tracker.matchThr = config.tracker_matching_thresholder
+        g_tracker.trackingThr = config.tracker_matching_threshold
+        # -----------------------------
+        return g_tracker
+
+
+    def reset_tracking(self):
+        '''
+            Starts tracking from scratch (e.g. for the next video file).
+            Models are kept, tracklets and cached results are dropped
+        '''
+        self.g_tracker = self.create_tracker()
+        self.results_cache = TrackletResultsCache(
+            config.tracker_max_lost_time,
+            config.cache_emotion_refresh_interval)
+        self.finished = []
+
+
+    def finish_all(self):
+        '''
+            Marks all tracked tracklets as finished (end of stream)
+        '''
+        with self.results_cache.lock:
+            entries = list(self.results_cache.entries.values())
+            self.results_cache.entries = {}
+        self.finish(entries)
+
+
+    def track(self, frame, timestamp):
+        '''
+            Runs the global tracker on the frame (frames.Frame or numpy array).
+            Returns tracklets, their positions are in the tracker
+            input coordinates - use tlet_rect() to map them to the frame
+        '''
+        if self.preprocessor is None:
+            # The same Image8U is used later by classifiers
+            image = utils.to_image8u(frame)
+        else:
+            # Tracker input is a separate image, classifiers
+            # still use the Image8U of the full frame
+            image = Image8U(self.preprocessor.prepare(frames.pixels(frame)))
+            frames.stats["conversions"] += 1
+        self.g_tracker.process(image, timestamp)
+        return self.g_tracker.tracklets
+
+
+    def tlet_rect(self, tlet):
+        '''
+            Returns IRect of the tracklet in the frame coordinates
+        '''
+        if self.preprocessor is None:
+            return utils.tlet2irect(tlet)
+        return self.preprocessor.to_frame(tlet.position)
 
 
     def detect_faces_on_image(self, img):
@@ -96,8 +329,8 @@ class FaceToolkit:
         if facerect is None:
             x = y = 0
             w = img.width
-            h = img.width
-            facerect = IRect(x, y, h, w)
+            h = img.height
+            facerect = IRect(x, y, w, h)
 
         points = self.points_detector.detectFromBbox(img, facerect)
         descriptor = self.extractor.enroll(img, points)
@@ -118,39 +351,40 @@ class FaceToolkit:
         return self.match_desc2desc(img_desc1, img_desc2)
 
 
-    def recognize_person(self, faceimg, dataset):
-        scores = {}
-        face_descriptor = self.extract_face_descriptor(faceimg)
-        for pers in dataset["persons"]:
-            pers_id = pers["id"]
-            sum_score = 0.0
-        
-            for desc in pers["descriptors"]:
-                sum_score += self.match_desc2desc(desc, face_descriptor)
-            avg_score = sum_score / len(pers["descriptors"])
+    def recognize_person(self, faceimg, dataset, k=1):
+        '''
+            Recognizes a person on a cropped face image.
 
-            if avg_score < 0.65:
-                continue
+            argument dataset:
+                - gallery.GalleryIndex or utils.read_persons_data() output
+                  (the index of the dict is built on the first call)
 
-            scores.update({avg_score: pers["name"]})
+            Returns best match {"name": ..., "score": ...}
+            or a list of k best matches if k > 1
+        '''
+        if not type(dataset) is GalleryIndex:
+            if self.dataset_index is None or not self.dataset_index[0] is dataset:
+                self.dataset_index = (dataset, GalleryIndex.from_persons_data(dataset))
+            dataset = self.dataset_index[1]
+        face_descriptor = self.extract_face_descriptor(faceimg)
+        matches = dataset.search(utils.desc2array(face_descriptor), self.matcher, k=k)
 
-        if len(scores.keys()) < 1:
+        if k > 1:
+            return matches
+        if len(matches) < 1:
             return {"name" : "unknown", "score": 0.0}
-        max_score = max(scores.keys())
-        max_scored_name = scores[max_score]
-        return {"name": max_scored_name, "score": max_score}
+        return {"name": matches[0]["name"], "score": matches[0]["score"]}
 
 
     def evaluate_quality(self, img, facerect=None):
-        img8u = Image8U(img)
+        img8u = utils.to_image8u(img)
 
         if facerect is None:
-            facerect = utils.img2irect(img)
+            facerect = utils.img2irect(img8u)
         elif type(facerect) is Tracklet:
-            facerect = utils.tlet2irect(facerect)
+            facerect = self.tlet_rect(facerect)
         quality = self.quality_evaluator.evaluate(img8u, facerect)
-
-
+        return quality
 
 
     def get_emotion(self, img, points=None, facerect=None):
@@ -158,69 +392,417 @@ class FaceToolkit:
         #     img - full frame with detection or cropped with face (not Image8U)
         #     points - antopologic points
         #     facerect - IRect object or Tracklet
-        img8u = Image8U(img)
+        img8u = utils.to_image8u(img)
+        if points is None:
+            points = self.get_points(img8u, facerect)
+        return self.classify_emotion(img8u, points)
+
+
+    def get_demographics(self, img, points=None, facerect=None):
+        img8u = utils.to_image8u(img)
+        if points is None:
+            points = self.get_points(img8u, facerect)
+        return self.classify_demographics(img8u, points)
 
+
+    def get_attributes(self, img, points=None, facerect=None):
+        img8u = utils.to_image8u(img)
+        # if antropologic points are not already calculated:
         if points is None:
+            points = self.get_points(img8u, facerect)
+        return self.classify_attributes(img8u, points)
+
 
-            if facerect is None:
-                facerect = utils.img2irect(img)
-            elif type(facerect) is Tracklet:
-                facerect = utils.tlet2irect(facerect)
-            points = self.points_detector.detectFromBbox(img8u, facerect)
+    def get_points(self, img8u, facerect=None):
+        # To caclculate points we should know a rect.
+        # If rect is None, then we suppose 
+        # that image is already cropped to a face size
+        # and rectangle of interest is a full image shape
+        if facerect is None:
+            facerect = utils.img2irect(img8u)
+        elif type(facerect) is Tracklet:
+            facerect = self.tlet_rect(facerect)
+        return self.points_detector.detectFromBbox(img8u, facerect)
 
+
+    def classify_emotion(self, img8u, points):
         emotions = self.emo_classifier.classify(img8u, points)
         return emotions.value
 
 
-    def get_demographics(self, img, points=None, facerect=None):
-        img8u = Image8U(img)
-        if points is None:
-            if facerect is None:
-                facerect = utils.img2irect(img)
-            elif type(facerect) is Tracklet:
-                facerect = utils.tlet2irect(facerect)
-
-            points = self.points_detector.detectFromBbox(img8u, facerect)
+    def classify_demographics(self, img8u, points):
         demographics = self.demo_classifier.classify(img8u, points)
-        gender = demographics.gender.value.name
-        age = int(demographics.age.value)
-        ethnicity = demographics.ethnicity.value.name
-        demo_dict = {
-            "gender": gender,
-            "age": age,
-            "ethnicity": ethnicity
+        return demographics2dict(demographics)
+
+
+    def classify_attributes(self, img8u, points):
+        attributes = self.attr_classifier.classify(img8u, points)
+        return attributes2dict(attributes)
+
+
+    def analyze(self, img, tracklets, timestamp=None, frame=None):
+        '''
+            Runs attributes, demographics and emotion
+            classifiers for every tracklet on the frame.
+
+            The frame is converted to Image8U only once
+            and antropologic points are calculated only
+            once per tracklet.
+
+            If timestamp is given, results are cached per tracklet:
+            attributes and demographics are classified only until
+            they converge, emotion is refreshed every
+            config.cache_emotion_refresh_interval ms.
+            With config.quality_gate faces are classified only on
+            frames passing quality checks, attributes and demographics
+            only on the best frames of the tracklet.
+            If numpy frame is given and keep_best_crops is set, crops
+            of the best frames are kept for descriptor extraction of
+            visits (see workers.VisitWorker), also when the gate is off.
+
+            Returns dict: {tracklet_id: {
+                "attributes": {...},
+                "demographics": {...},
+                "emotion": ...}}
+        '''
+        analysis = FrameAnalysis(self, img)
+        results = {}
+
+        if timestamp is None:
+            for tlet in tracklets:
+                results[tlet.id] = analysis.analyze_tracklet(tlet)
+            return results
+
+        for tlet in tracklets:
+            if tlet.state == TRACKLET_STATE.LOST:
+                # Face is not visible, last results are kept
+                entry = self.results_cache.get(tlet.id, timestamp, seen=False)
+                results[tlet.id] = entry.results()
+                continue
+            with timing.timer.stage("tracklet", tracklet=tlet.id):
+                entry = self.results_cache.get(tlet.id, timestamp)
+                need_stable, need_emotion = self.plan_analysis(
+                    analysis, entry, tlet, timestamp, frame)
+                if need_stable:
+                    entry.add_stable(
+                        analysis.get_attributes(tlet),
+                        analysis.get_demographics(tlet))
+                if need_emotion:
+                    entry.set_emotion(analysis.get_emotion(tlet), timestamp)
+                results[tlet.id] = entry.results()
+
+        self.finish(self.results_cache.evict(timestamp, set(tlet.id for tlet in tracklets)))
+        return results
+
+
+    def analyze_async(self, frame, tracklets, timestamp, img=None):
+        '''
+            Same as analyze() with cache, but classification is
+            submitted to the classifier worker pool.
+            img is an optional Image8U of the frame for quality checks.
+            Returns the last known results of every tracklet
+            (empty dicts and None until the first results arrive)
+        '''
+        self.get_classifier_pool()
+
+        analysis = FrameAnalysis(self, frame if img is None else img)
+        results = {}
+        with self.results_cache.lock:
+            for tlet in tracklets:
+                lost = tlet.state == TRACKLET_STATE.LOST
+                entry = self.results_cache.get(tlet.id, timestamp, seen=not lost)
+                if lost or entry.pending:
+                    results[tlet.id] = entry.results()
+                    continue
+                need_stable, need_emotion = self.plan_analysis(
+                    analysis, entry, tlet, timestamp, frame)
+                if need_stable or need_emotion:
+                    entry.pending = self.classifier_pool.submit(
+                        self.results_cache, tlet, frame, timestamp,
+                        need_stable, need_emotion, self.tlet_rect(tlet))
+                results[tlet.id] = entry.results()
+                if not entry.updated_time is None:
+                    timing.timer.record("result_age", timestamp - entry.updated_time)
+
+            self.finish(self.results_cache.evict(timestamp, set(tlet.id for tlet in tracklets)))
+        return results
+
+
+    def finish(self, entries):
+        for entry in entries:
+            timing.timer.forget_tracklet(entry.id)
+        self.finished.extend(entries)
+
+
+    def pop_finished(self):
+        '''
+            Returns results entries of tracklets finished
+            since the last call
+        '''
+        finished, self.finished = self.finished, []
+        return finished
+
+
+    def plan_analysis(self, analysis, entry, tlet, timestamp, frame=None):
+        '''
+            Decides which classifiers the tracklet needs on this frame.
+            Returns (need_stable, need_emotion)
+        '''
+        need_stable = not entry.converged
+        need_emotion = entry.emotion_expired(
+            timestamp, self.results_cache.emotion_refresh_interval)
+        if not (need_stable or need_emotion):
+            return need_stable, need_emotion
+        if not config.quality_gate:
+            if self.keep_best_crops:
+                # Visits still need the best frame for the descriptor,
+                # it is picked on the same frames as with the gate
+                self.offer_best_frame(analysis, entry, tlet, timestamp, frame)
+            return need_stable, need_emotion
+
+        is_best = self.offer_best_frame(analysis, entry, tlet, timestamp, frame)
+        if is_best is None:
+            return False, False
+        return need_stable and is_best, need_emotion
+
+
+    def offer_best_frame(self, analysis, entry, tlet, timestamp, frame=None):
+        '''
+            Evaluates the face quality and keeps the crop if the
+            frame is one of the best frames of the tracklet.
+            Returns None if the face fails quality checks,
+            otherwise True if the frame is one of the best
+        '''
+        score = analysis.get_quality_score(tlet)
+        if score is None:
+            return None
+
+        crop = facerect = None
+        if self.keep_best_crops and entry.best_frames.accepts(score) and not frame is None:
+            crop, facerect = utils.crop_rect(frame, self.tlet_rect(tlet), config.classifier_crop_margin)
+        return entry.best_frames.offer(score, timestamp, crop, facerect)
+
+
+    def close(self):
+        if not self.classifier_pool is None:
+            self.classifier_pool.stop()
+            self.classifier_pool = None
+        if not self.visit_worker is None:
+            self.visit_worker.stop()
+            self.visit_worker = None
+
+
+def demographics2dict(demographics):
+    gender = demographics.gender.value.name
+    age = int(demographics.age.value)
+    ethnicity = demographics.ethnicity.value.name
+    demo_dict = {
+        "gender": gender,
+        "age": age,
+        "ethnicity": ethnicity
+    }
+    return demo_dict
+
+
+def attributes2dict(attributes):
+    facial_hair = attributes.facial_hair.value.name
+    glasses = attributes.glasses.value.name
+    hair_color = attributes.hair_color.value.name
+    hair_type = attributes.hair_type.value.name
+    headwear = attributes.headwear.value.name
+
+    attr_dict = {
+        "facial_hair": facial_hair,
+        "hair_color": hair_color,
+        "hair_type": hair_type,
+        "headwear": headwear,
+        "glasses": glasses
+    }
+    return attr_dict
+
+
+class TrackletResults:
+    '''
+        Classification results collected for one tracklet.
+
+        Attributes and demographics are voted over the first
+        samples and frozen once they converge.
+        Emotion is volatile and is only remembered with its timestamp.
+    '''
+
+    def __init__(self, tlet_id, timestamp):
+        self.id = tlet_id
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+
+        self.samples = 0
+        self.votes = {}
+        self.ages = []
+        self.converged = False
+        self.attributes = {}
+        self.demographics = {}
+
+        self.emotion = None
+        self.emotion_time = None
+        self.emotion_votes = Counter()
+
+        self.best_frames = BestFrames(config.quality_best_frames_num)
+
+        # Classification job of this tracklet is in the worker pool
+        self.pending = False
+        self.updated_time = None
+
+
+    def add_stable(self, attributes, demographics):
+        self.samples += 1
+        for key, val in list(attributes.items()) + list(demographics.items()):
+            if key == "age":
+                self.ages.append(val)
+            else:
+                self.votes.setdefault(key, Counter())[val] += 1
+
+        self.attributes = {key: self.vote(key) for key in attributes}
+        self.demographics = {key: self.vote(key) for key in demographics}
+
+        if self.samples >= config.cache_stable_max_samples:
+            self.converged = True
+        elif self.samples >= config.cache_stable_samples:
+            self.converged = all(
+                counter.most_common(1)[0][1] >= self.samples * config.cache_stable_agreement
+                for counter in self.votes.values())
+
+
+    def vote(self, key):
+        if key == "age":
+            return int(np.median(self.ages))
+        return self.votes[key].most_common(1)[0][0]
+
+
+    def emotion_expired(self, timestamp, refresh_interval):
+        if self.emotion_time is None:
+            return True
+        return timestamp - self.emotion_time >= refresh_interval
+
+
+    def set_emotion(self, emotion, timestamp):
+        self.emotion = emotion
+        self.emotion_time = timestamp
+        self.emotion_votes[str(emotion)] += 1
+
+
+    def results(self):
+        return {
+            "attributes": self.attributes,
+            "demographics": self.demographics,
+            "emotion": self.emotion
         }
-        return demo_dict
 
 
-    def get_attributes(self, img, points=None, facerect=None):
-        img8u = Image8U(img)
-        # if antropologic points are not already calculated:
-        if points is None:
-            # To caclculate points we should know a rect.
-            # If rect is None, then we suppose 
-            # that image is already cropped to a face size
-            # and rectangle of interest is a full image shape
-            if facerect is None:
-                facerect = utils.img2irect(img)
-            elif type(facerect) is Tracklet:
-                facerect = utils.tlet2irect(facerect)
+class TrackletResultsCache:
+    '''
+        Tracklet-keyed store of classification results.
 
-            points = self.points_detector.detectFromBbox(img8u, facerect)
+        Entries are evicted when the global tracker drops the
+        tracklet or, if the tracklets are not known, when it
+        was not seen for longer than max_lost_time ms.
+        LOST tracklets are not seen, so a visit ends when
+        the face was seen the last time.
+    '''
+
+    def __init__(self, max_lost_time, emotion_refresh_interval):
+        self.max_lost_time = max_lost_time
+        self.emotion_refresh_interval = emotion_refresh_interval
+        self.entries = {}
+        # Guards entries updated by classifier workers
+        self.lock = threading.RLock()
+
+
+    def get(self, tlet_id, timestamp, seen=True):
+        entry = self.entries.get(tlet_id)
+        if entry is None:
+            entry = TrackletResults(tlet_id, timestamp)
+            self.entries[tlet_id] = entry
+        if seen:
+            entry.last_seen = timestamp
+        return entry
+
+
+    def evict(self, timestamp, tracked_ids=None):
+        '''
+            Removes entries of dropped tracklets and returns them.
+            tracked_ids are ids of all tracklets of the tracker.
+        '''
+        if tracked_ids is None:
+            evicted = [
+                entry for entry in self.entries.values()
+                if timestamp - entry.last_seen > self.max_lost_time]
+        else:
+            evicted = [
+                entry for entry in self.entries.values()
+                if not entry.id in tracked_ids]
+        for entry in evicted:
+            del self.entries[entry.id]
+        return evicted
+
+
+class FrameAnalysis:
+    '''
+        Per-frame analysis context.
+
+        Holds a single Image8U view of the frame
+        and caches antropologic points per tracklet,
+        so all classifiers share them.
+    '''
+
+    def __init__(self, ftool, img):
+        self.ftool = ftool
+        self.img = img
+        self.image8u = None
+        self.points = {}
+
+
+    @property
+    def img8u(self):
+        # Frame is converted only if some tracklet needs analysis
+        if self.image8u is None:
+            self.image8u = utils.to_image8u(self.img)
+        return self.image8u
+
+
+    def get_points(self, tlet):
+        if not tlet.id in self.points:
+            with timing.timer.stage("points"):
+                self.points[tlet.id] = self.ftool.get_points(self.img8u, tlet)
+        return self.points[tlet.id]
+
+
+    def get_quality_score(self, tlet):
+        with timing.timer.stage("quality"):
+            quality = self.ftool.evaluate_quality(self.img8u, tlet)
+        return quality_score(quality)
+
+
+    def get_attributes(self, tlet):
+        points = self.get_points(tlet)
+        with timing.timer.stage("attributes"):
+            return self.ftool.classify_attributes(self.img8u, points)
+
+
+    def get_demographics(self, tlet):
+        points = self.get_points(tlet)
+        with timing.timer.stage("demographics"):
+            return self.ftool.classify_demographics(self.img8u, points)
+
+
+    def get_emotion(self, tlet):
+        points = self.get_points(tlet)
+        with timing.timer.stage("emotion"):
+            return self.ftool.classify_emotion(self.img8u, points)
 
-        attributes = self.attr_classifier.classify(img8u, points)
 
-        facial_hair = attributes.facial_hair.value.name
-        glasses = attributes.glasses.value.name
-        hair_color = attributes.hair_color.value.name
-        hair_type = attributes.hair_type.value.name
-        headwear = attributes.headwear.value.name
-
-        attr_dict = {
-            "facial_hair": facial_hair,
-            "hair_color": hair_color,
-            "hair_type": hair_type,
-            "headwear": headwear,
-            "glasses": glasses
+    def analyze_tracklet(self, tlet):
+        return {
+            "attributes": self.get_attributes(tlet),
+            "demographics": self.get_demographics(tlet),
+            "emotion": self.get_emotion(tlet)
         }
-        return attr_dict
\ No newline at end of file
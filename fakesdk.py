@@ -0,0 +1,445 @@
+'''
+    Deterministic stand-in for the pyfacesdk module.
+
+    Provides the part of the FaceSDK API used by this project,
+    so the pipeline can be benchmarked and tested without
+    the proprietary SDK and a camera.
+
+    Every SDK call sleeps for a configurable synthetic latency
+    (see configure()), tracklets are generated by a fixed
+    scenario of persons walking across the frame.
+
+    The tracker stamps a pixel signature of the person into the
+    center of every visible face (see _stamp_person), so models
+    running on face crops (classifier and visit workers) find
+    the person from the image content, as real models do.
+    When the tracker runs on a separate (downscaled) input, the
+    frame is not stamped and the person is looked up in the last
+    processed scene instead.
+
+    Enable it with config.sdk_backend = "fake"
+    or FACESDK_BACKEND=fake environment variable.
+'''
+import enum
+import hashlib
+import time
+
+import numpy as np
+
+
+__all__ = [
+    "Image8U", "Descriptor", "IRect", "URect", "USize",
+    "DETECTOR_TYPE", "TRACKLET_STATE", "Tracklet",
+    "IGlobalTracker", "IPointsDetector", "IExtractor", "IDetector",
+    "IMatcher", "IQualityEvaluator", "IAttributes", "IDemographics", "IEmotions",
+]
+
+
+# Synthetic latency of every SDK call, seconds
+LATENCIES = {
+    "tracker": 0.008,
+    "points": 0.002,
+    "extractor": 0.010,
+    "detector": 0.015,
+    "matcher": 0.00001,
+    "quality": 0.001,
+    "attributes": 0.006,
+    "demographics": 0.006,
+    "emotions": 0.004,
+    "model_load": 0.0,
+}
+
+# Scenario of the fake tracker
+SCENARIO = {
+    "seed": 0,
+    "persons": 50,
+    # Person is visible for this long (ms)
+    "visit_time": 4000,
+    # New person appears every N ms
+    "arrival_period": 1500,
+}
+
+
+def configure(latencies=None, **scenario):
+    '''
+        Updates synthetic latencies and tracker scenario.
+        configure({"tracker": 0.0}, persons=10)
+    '''
+    if latencies:
+        LATENCIES.update(latencies)
+    SCENARIO.update(scenario)
+
+
+def _sleep(name):
+    latency = LATENCIES.get(name, 0.0)
+    if latency > 0:
+        time.sleep(latency)
+
+
+def _seed(*values):
+    digest = hashlib.md5(repr(values).encode()).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+# =======================
+# Basic types           |
+# =======================
+
+class Image8U:
+
+    def __init__(self, img):
+        self.data = np.ascontiguousarray(img, np.uint8)
+        self.height = self.data.shape[0]
+        self.width = self.data.shape[1]
+
+
+class Descriptor:
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+
+class IRect:
+
+    def __init__(self, x=0, y=0, w=0, h=0):
+        self.x, self.y, self.w, self.h = int(x), int(y), int(w), int(h)
+
+    def __repr__(self):
+        return "IRect(%d, %d, %d, %d)" % (self.x, self.y, self.w, self.h)
+
+
+class URect(IRect):
+    pass
+
+
+class USize:
+
+    def __init__(self, x=0, y=0):
+        self.x, self.y = int(x), int(y)
+
+
+class DETECTOR_TYPE(enum.Enum):
+    ALG1 = 1
+    ALG2 = 2
+
+
+class TRACKLET_STATE(enum.Enum):
+    NEW = 0
+    TRACKED = 1
+    LOST = 2
+
+
+class Value:
+    '''
+        Classifier output field: field.value is an enum member
+        (or a number for age)
+    '''
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Result:
+
+    def __init__(self, **fields):
+        for key, val in fields.items():
+            setattr(self, key, Value(val))
+
+
+GENDER = enum.Enum("GENDER", "MALE FEMALE")
+ETHNICITY = enum.Enum("ETHNICITY", "ASIAN BLACK CAUCASIAN HISPANIC")
+EMOTION = enum.Enum("EMOTION", "NEUTRAL HAPPY SAD SURPRISED ANGRY")
+FACIAL_HAIR = enum.Enum("FACIAL_HAIR", "NONE BEARD MUSTACHE")
+GLASSES = enum.Enum("GLASSES", "NONE EYE SUN")
+HAIR_COLOR = enum.Enum("HAIR_COLOR", "BLACK BROWN BLOND GRAY")
+HAIR_TYPE = enum.Enum("HAIR_TYPE", "STRAIGHT CURLY BALD")
+HEADWEAR = enum.Enum("HEADWEAR", "NONE HAT CAP")
+
+
+def _pick(enum_cls, seed):
+    members = list(enum_cls)
+    return members[seed % len(members)]
+
+
+# =======================
+# Tracking              |
+# =======================
+
+class Tracklet:
+
+    def __init__(self, tlet_id, person, start_time):
+        self.id = tlet_id
+        self.person = person
+        self.start_time = start_time
+        self.position = IRect()
+        self.state = TRACKLET_STATE.NEW
+        self.last_seen = start_time
+
+
+class Points:
+    '''
+        Antropologic points. Remembers the face rect and the
+        person of the scenario, so classifiers are deterministic
+    '''
+
+    def __init__(self, rect, person):
+        self.rect = rect
+        self.person = person
+
+
+# Last processed scene, used to find the person behind
+# a face rect on images without the person signature
+_scene = {"tracklets": []}
+
+# First channel of the person signature pixels
+SIGNATURE_MARKER = 0xA5
+
+
+def _stamp_person(img, rect, person):
+    '''
+        Fills a small square in the center of the face
+        with the signature: (marker, person low byte, high byte)
+    '''
+    data = img.data
+    if data.ndim != 3 or not data.flags.writeable:
+        return
+    half = max(1, min(rect.w, rect.h) // 16)
+    cx, cy = rect.x + rect.w // 2, rect.y + rect.h // 2
+    data[max(0, cy - half):cy + half + 1, max(0, cx - half):cx + half + 1] = (
+        SIGNATURE_MARKER, person & 0xFF, (person >> 8) & 0xFF)
+
+
+def _read_person(img, rect):
+    '''
+        Returns the person of the signature in the face center
+        or None if the image has no signature there
+    '''
+    data = img.data
+    cx, cy = rect.x + rect.w // 2, rect.y + rect.h // 2
+    if data.ndim != 3 or not (1 <= cx < data.shape[1] - 1 and 1 <= cy < data.shape[0] - 1):
+        return None
+    patch = data[cy - 1:cy + 2, cx - 1:cx + 2].reshape(-1, data.shape[2])
+    if (patch != patch[0]).any() or patch[0][0] != SIGNATURE_MARKER:
+        return None
+    return int(patch[0][1]) | (int(patch[0][2]) << 8)
+
+
+def _person_at(img, rect):
+    person = _read_person(img, rect)
+    if not person is None:
+        return person
+    cx, cy = rect.x + rect.w // 2, rect.y + rect.h // 2
+    for tlet in _scene["tracklets"]:
+        pos = tlet.position
+        if pos.x <= cx < pos.x + pos.w and pos.y <= cy < pos.y + pos.h:
+            return tlet.person
+    return _seed(rect.x // 32, rect.y // 32, rect.w // 32) % 100000
+
+
+class IGlobalTracker:
+
+    def __init__(self):
+        _sleep("model_load")
+        self.maxFaceSize = USize(400, 400)
+        self.minFaceSize = USize(20, 20)
+        self.roi = URect(0, 0, 0, 0)
+        self.maxLostTime = 1000
+        self.bestFaceScale = 2.0
+        self.bestFramesNum = 4
+        self.detectionAlg = DETECTOR_TYPE.ALG1
+        self.detectionFilter = True
+        self.detectionFilterThr = 0.4
+        self.detectionPeriod = 10
+        self.detectionThr = 0.4
+        self.favorLongTracks = True
+        self.matchThr = True
+        self.trackingThr = 0.4
+        self.tracklets = []
+        self.frames = 0
+        self._tracks = {}
+
+
+    def process(self, img, timestamp):
+        _sleep("tracker")
+        self.frames += 1
+        width, height = img.width, img.height
+        visit_time = SCENARIO["visit_time"]
+        period = SCENARIO["arrival_period"]
+        persons = SCENARIO["persons"]
+
+        # Persons whose visit window covers the timestamp are visible
+        first = max(0, (timestamp - visit_time) // period + 1)
+        last = timestamp // period
+        visible = set()
+        for n in range(int(first), int(last) + 1):
+            start = n * period
+            # Returning visitors: person ids repeat over the scenario
+            person = _seed(SCENARIO["seed"], n) % persons
+            visible.add(n)
+            tlet = self._tracks.get(n)
+            if tlet is None:
+                tlet = self._tracks[n] = Tracklet(n + 1, person, start)
+
+            progress = float(timestamp - start) / visit_time
+            size = max(self.minFaceSize.x, min(self.maxFaceSize.x, height // 5))
+            size = min(size, width, height)
+            lane = _seed(SCENARIO["seed"], n, "lane") % max(1, height - size)
+            tlet.position = IRect(
+                int(progress * (width - size)), lane, size, size)
+            tlet.state = TRACKLET_STATE.TRACKED if progress > 0.05 else TRACKLET_STATE.NEW
+            tlet.last_seen = timestamp
+            _stamp_person(img, tlet.position, person)
+
+        # Tracklets not visible anymore stay LOST for maxLostTime
+        for n, tlet in list(self._tracks.items()):
+            if n in visible:
+                continue
+            tlet.state = TRACKLET_STATE.LOST
+            if timestamp - tlet.last_seen > self.maxLostTime:
+                del self._tracks[n]
+
+        self.tracklets = [self._tracks[n] for n in sorted(self._tracks)]
+        _scene["tracklets"] = self.tracklets
+
+
+class IDetector:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def detect(self, img, roi, minsize, maxsize, precision_level):
+        _sleep("detector")
+        if not _scene["tracklets"]:
+            # No tracked scene (e.g. enrollment photos):
+            # one face in the middle of the image
+            size = min(img.width, img.height) // 2
+            return [IRect((img.width - size) // 2, (img.height - size) // 2, size, size)]
+        return [IRect(t.position.x, t.position.y, t.position.w, t.position.h)
+            for t in _scene["tracklets"] if t.state != TRACKLET_STATE.LOST]
+
+
+class IPointsDetector:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def detectFromBbox(self, img, rect):
+        _sleep("points")
+        return Points(rect, _person_at(img, rect))
+
+
+# =======================
+# Recognition           |
+# =======================
+
+DESCRIPTOR_SIZE = 512
+
+
+class IExtractor:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def enroll(self, img, points):
+        _sleep("extractor")
+        base = np.random.default_rng(points.person).integers(0, 256, DESCRIPTOR_SIZE)
+        noise = np.random.default_rng(
+            _seed(points.rect.x, points.rect.y, points.rect.w)).integers(-6, 7, DESCRIPTOR_SIZE)
+        return Descriptor(np.clip(base + noise, 0, 255).astype(np.uint8).tobytes())
+
+
+class IMatcher:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def match(self, desc1, desc2):
+        _sleep("matcher")
+        v1 = np.frombuffer(bytes(desc1.data), np.uint8).astype(np.float32) - 128.0
+        v2 = np.frombuffer(bytes(desc2.data), np.uint8).astype(np.float32) - 128.0
+        norm = np.linalg.norm(v1) * np.linalg.norm(v2)
+        cosine = v1.dot(v2) / norm if norm else 0.0
+        # Matcher scores are calibrated, they are not the
+        # descriptors similarity (steep around 0.5 as a real one)
+        return float(1.0 / (1.0 + np.exp(-12.0 * (cosine - 0.5))))
+
+
+class QualityConfig:
+
+    def __init__(self):
+        self.blurrines = False
+        self.angles = False
+        self.resolution = False
+
+
+class Angles:
+
+    def __init__(self, yaw, pitch, roll):
+        self.yaw, self.pitch, self.roll = yaw, pitch, roll
+
+
+class Quality:
+
+    def __init__(self, blurriness, angles, resolution):
+        self.blurriness = blurriness
+        self.angles = angles
+        self.resolution = resolution
+
+
+class IQualityEvaluator:
+
+    def __init__(self):
+        _sleep("model_load")
+        self.config = QualityConfig()
+
+    def evaluate(self, img, rect):
+        _sleep("quality")
+        seed = _seed(rect.x // 8, rect.y // 8, rect.w)
+        return Quality(
+            blurriness=(seed % 100) / 100.0,
+            angles=Angles(seed % 60 - 30, (seed >> 8) % 40 - 20, (seed >> 16) % 20 - 10),
+            resolution=min(rect.w, rect.h))
+
+
+# =======================
+# Classifiers           |
+# =======================
+
+class IAttributes:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def classify(self, img, points):
+        _sleep("attributes")
+        seed = points.person
+        return Result(
+            facial_hair=_pick(FACIAL_HAIR, seed),
+            glasses=_pick(GLASSES, seed >> 2),
+            hair_color=_pick(HAIR_COLOR, seed >> 4),
+            hair_type=_pick(HAIR_TYPE, seed >> 6),
+            headwear=_pick(HEADWEAR, seed >> 8))
+
+
+class IDemographics:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def classify(self, img, points):
+        _sleep("demographics")
+        seed = points.person
+        return Result(
+            gender=_pick(GENDER, seed),
+            age=18 + seed % 50 + points.rect.x % 3,
+            ethnicity=_pick(ETHNICITY, seed >> 3))
+
+
+class IEmotions:
+
+    def __init__(self):
+        _sleep("model_load")
+
+    def classify(self, img, points):
+        _sleep("emotions")
+        return Value(_pick(EMOTION, points.person + points.rect.x // 50))
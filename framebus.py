@@ -0,0 +1,401 @@
+'''
+    Shared memory frame bus.
+
+    The capture process decodes frames directly into a fixed pool
+    of shared memory slots and publishes them to consumer processes:
+        - tracker: tracking, classification and visits counting
+        - render: drawing and display (tracked frames with their results)
+        - record: raw frames video log (when config.write_videolog)
+
+    Consumers map the slots zero-copy. Every slot has a reference
+    counter, a slot goes back to the free list when the last consumer
+    releases it. Only small metadata (slot number, timestamps,
+    tracklet records) travels over the queues.
+
+    Usage:
+        python main.py --bus
+'''
+import multiprocessing as mp
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import config
+import utils
+from frames import Frame
+
+
+class FrameBus:
+    '''
+        Fixed pool of frame slots in shared memory.
+
+        Works as frames.FramePool for the decoder of the capture
+        process: acquire() takes a free slot, release() drops one
+        reference of the frame slot. The bus object is passed to
+        consumer processes, they attach to the same memory.
+
+        argument shape:
+            - shape of the frames (h, w, 3)
+        argument consumers:
+            - names of consumer queues
+    '''
+
+    def __init__(self, shape, consumers, slots_num=None, context=None):
+        context = context or mp.get_context("spawn")
+        self.shape = tuple(shape)
+        self.slot_size = int(np.prod(self.shape))
+        self.slots_num = slots_num or config.frame_bus_slots
+        self.timeout = config.frame_bus_timeout
+
+        self.data = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slots_num)
+        self.refs_data = shared_memory.SharedMemory(create=True, size=4 * self.slots_num)
+        self.lock = context.Lock()
+        self.free_slots = context.Queue()
+        self.queues = {name: context.Queue() for name in consumers}
+        self.owner = True
+        self.map()
+
+        self.refs[:] = 0
+        for slot in range(self.slots_num):
+            self.free_slots.put(slot)
+
+
+    def map(self):
+        self.refs = np.ndarray((self.slots_num,), np.int32, buffer=self.refs_data.buf)
+        self.slots = [
+            np.ndarray(self.shape, np.uint8, buffer=self.data.buf, offset=slot * self.slot_size)
+            for slot in range(self.slots_num)]
+        self.base = self.slots[0].__array_interface__["data"][0]
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("data", "refs_data", "refs", "slots", "base"):
+            del state[key]
+        state["data_name"] = self.data.name
+        state["refs_name"] = self.refs_data.name
+        state["owner"] = False
+        return state
+
+
+    def __setstate__(self, state):
+        data_name = state.pop("data_name")
+        refs_name = state.pop("refs_name")
+        self.__dict__.update(state)
+        self.data = shared_memory.SharedMemory(name=data_name)
+        self.refs_data = shared_memory.SharedMemory(name=refs_name)
+        self.map()
+
+
+    def slot_of(self, pixels):
+        '''
+            Returns the slot number of the pixels array
+            or None if it is not a slot of the bus
+        '''
+        offset = pixels.__array_interface__["data"][0] - self.base
+        if offset < 0 or offset % self.slot_size or pixels.shape != self.shape:
+            return None
+        slot = offset // self.slot_size
+        return slot if slot < self.slots_num else None
+
+
+    def acquire(self, shape):
+        '''
+            Takes a free slot, waits for consumers releasing
+            slots not longer than config.frame_bus_timeout seconds
+        '''
+        if tuple(shape) != self.shape:
+            return np.empty(shape, np.uint8)
+        try:
+            slot = self.free_slots.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("No free frame slots for %.1f s, consumers are stuck" % self.timeout)
+        with self.lock:
+            self.refs[slot] = 1
+        return self.slots[slot]
+
+
+    def release(self, pixels):
+        slot = self.slot_of(pixels)
+        if not slot is None:
+            self.unref(slot)
+
+
+    def unref(self, slot):
+        with self.lock:
+            self.refs[slot] -= 1
+            free = self.refs[slot] == 0
+        if free:
+            self.free_slots.put(slot)
+
+
+    def publish(self, frame, consumers=None):
+        '''
+            Sends the frame to the consumers,
+            the capture process reference is released
+        '''
+        consumers = list(self.queues) if consumers is None else consumers
+        slot = self.slot_of(frame.pixels)
+        if slot is None:
+            # Frame of an unexpected size was decoded to a private buffer
+            pixels = self.acquire(self.shape)
+            slot = self.slot_of(pixels)
+            cv2.resize(frame.pixels, (self.shape[1], self.shape[0]), dst=pixels)
+            frame.release()
+        else:
+            # Capture reference is taken over by consumers
+            frame.pixels = None
+            frame.image = None
+        with self.lock:
+            self.refs[slot] += len(consumers) - 1
+        if not consumers:
+            self.free_slots.put(slot)
+            return
+
+        message = {
+            "slot": slot,
+            "timestamp": frame.timestamp,
+            "capture_time": frame.capture_time
+        }
+        for name in consumers:
+            self.queues[name].put(message)
+
+
+    def forward(self, frame, consumer, **metadata):
+        '''
+            Hands the frame reference over to another consumer,
+            metadata is sent with the frame
+        '''
+        message = {
+            "slot": self.slot_of(frame.pixels),
+            "timestamp": frame.timestamp,
+            "capture_time": frame.capture_time
+        }
+        message.update(metadata)
+        frame.pixels = None
+        frame.image = None
+        self.queues[consumer].put(message)
+
+
+    def receive(self, consumer, latest=False):
+        '''
+            Returns (frames.Frame, message) of the next frame or
+            (None, None) at the end of the stream.
+            With latest=True older queued frames are released
+            and only the newest one is returned.
+        '''
+        message = self.queues[consumer].get()
+        if latest:
+            while not message is None:
+                try:
+                    newer = self.queues[consumer].get_nowait()
+                except queue.Empty:
+                    break
+                self.unref(message["slot"])
+                message = newer
+        if message is None:
+            return None, None
+        frame = Frame(self.slots[message["slot"]], message["capture_time"], self, message["timestamp"])
+        return frame, message
+
+
+    def end(self, consumers=None):
+        consumers = list(self.queues) if consumers is None else consumers
+        for name in consumers:
+            self.queues[name].put(None)
+
+
+    def close(self):
+        # Views must be dropped before the memory is unmapped
+        self.refs = None
+        self.slots = None
+        self.data.close()
+        self.refs_data.close()
+        if self.owner:
+            self.data.unlink()
+            self.refs_data.unlink()
+
+
+# ==========================================================
+# CONSUMER PROCESSES
+
+
+def tracker_process(bus, video_dict, live, render, results_path):
+    import json
+    import facetools
+    import main
+    import reid
+    import visits
+
+    # Without the renderer records are written as by main.run_headless,
+    # the file is opened first, so with stdout results the startup
+    # messages are logged to stderr too
+    results_file = None
+    if not render:
+        results_file = main.open_results_file(results_path)
+
+    ftool = facetools.FaceToolkit(video_dict)
+    if config.models_warm_up:
+        ftool.warm_up()
+    journal = visitors = None
+    if config.count_visits:
+        journal = visits.VisitJournal()
+        journal.start()
+        if config.reid_enabled:
+            visitors = reid.VisitorGallery()
+
+    frames_num = 0
+    while True:
+        # Live frames which waited while the previous one
+        # was processed are stale, only the newest is tracked
+        frame, message = bus.receive("tracker", latest=live)
+        if frame is None:
+            break
+        frames_num += 1
+        tracklets, analysis = main.process_frame(ftool, frame, frame.timestamp, journal, visitors)
+        if not render and (results_file is None or not tracklets):
+            frame.release()
+            continue
+        records = [
+            utils.tracklet_record(tlet, analysis[tlet.id], frame.timestamp, ftool.tlet_rect(tlet))
+            for tlet in tracklets]
+        if render:
+            bus.forward(frame, "render", tracklets=records)
+            continue
+        frame.release()
+        results_file.write(json.dumps({"timestamp": frame.timestamp, "tracklets": records}) + "\n")
+
+    if render:
+        bus.end(["render"])
+    ftool.finish_all()
+    main.record_visits(ftool, journal, visitors)
+    ftool.close()
+    if not journal is None:
+        journal.close()
+    if not results_file is None and not results_file is sys.stdout:
+        results_file.close()
+    utils.log("Tracker processed %d frames" % frames_num)
+
+
+def render_process(bus):
+    import compositor
+    import main
+    import timing
+    from sdk import IRect
+
+    overlay = compositor.OverlayCompositor()
+    while True:
+        frame, message = bus.receive("render")
+        if frame is None:
+            break
+        view = overlay.begin(frame.pixels)
+        frame.release()
+
+        records = message["tracklets"]
+        for record in records:
+            utils.draw_tracklet_on_frame(
+                view,
+                None,
+                color=utils.random_color(record["id"]),
+                tlet_age=record["age"],
+                tlet_state=record["state"],
+                rect=IRect(*record["rect"]))
+        overlay.draw_panel([
+            (record["id"], main.tracklet_info(record["id"], record))
+            for record in records])
+
+        cv2.imshow("Frames from camera", overlay.canvas)
+        timing.timer.record("latency", (time.monotonic() - message["capture_time"]) * 1000.0)
+        cv2.waitKey(1)
+    timing.timer.report()
+
+
+def record_process(bus, fps, log_stderr):
+    import logger
+    import videolog
+
+    if log_stderr:
+        # Results of the tracker are written to stdout
+        logger.logger.stream = sys.stderr
+
+    recorder = videolog.VideoLogRecorder(fps)
+    recorder.start()
+    while True:
+        frame, message = bus.receive("record")
+        if frame is None:
+            break
+        recorder.put(frame.pixels)
+        frame.release()
+    recorder.close()
+    utils.log("Video log stats: %s" % str(recorder.stats()))
+
+
+# ==========================================================
+
+
+def run(source, headless, results_path):
+    '''
+        Capture process: decodes frames into the bus
+        and publishes them to the consumer processes.
+        Consumers are spawned and re-import config, so settings
+        changed in the parent are passed explicitly:
+        headless and results_path (config.results_file,
+        results are written in headless mode).
+    '''
+    import camtools
+    import timing
+
+    cam = camtools.CamToolkit(source, threaded=False)
+    live = not cam.is_file
+    render = not headless
+    consumers = ["tracker"]
+    if render:
+        consumers.append("render")
+    if config.write_videolog:
+        consumers.append("record")
+
+    context = mp.get_context("spawn")
+    bus = FrameBus((cam.video_dict["h"], cam.video_dict["w"], 3), consumers, context=context)
+    cam.use_pool(bus)
+
+    processes = [context.Process(
+        target=tracker_process, args=(bus, cam.video_dict, live, render, results_path), name="tracker")]
+    if render:
+        processes.append(context.Process(target=render_process, args=(bus,), name="render"))
+    if config.write_videolog:
+        processes.append(context.Process(target=record_process, args=(bus, cam.fps, headless and results_path == "-"), name="record"))
+    for process in processes:
+        process.start()
+
+    # Tracker forwards frames to the renderer, so only
+    # the tracker and the recorder get frames from capture
+    published = [name for name in consumers if name != "render"]
+    frames_num = 0
+    start_time = time.time()
+    try:
+        while True:
+            with timing.timer.stage("capture"):
+                frame = cam.get_frame()
+            if frame is None:
+                break
+            bus.publish(frame, published)
+            frames_num += 1
+    finally:
+        bus.end(published)
+        tracker = processes[0]
+        tracker.join()
+        if render and tracker.exitcode != 0:
+            # Renderer gets frames only from the tracker
+            bus.end(["render"])
+        for process in processes[1:]:
+            process.join()
+        cam.release()
+        bus.close()
+
+    elapsed = time.time() - start_time
+    utils.log("Captured %d frames in %.1f s (%.1f fps)" %
+        (frames_num, elapsed, frames_num / max(elapsed, 1e-6)))
@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+
+from sdk import Image8U
+
+
+# Per-process counters, see reset_stats()
+stats = {
+    "frames": 0,
+    "allocations": 0,
+    "conversions": 0
+}
+
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+
+
+class Frame:
+    '''
+        Video frame passed through the whole pipeline.
+
+        Owns a contiguous pixel buffer (usually taken from
+        a FramePool) and creates its Image8U view lazily,
+        so the frame is converted for FaceSDK at most once.
+        release() returns the buffer to the pool.
+
+        capture_time is time.monotonic() of decoding,
+        timestamp (ms) is the position of the frame in the stream.
+    '''
+
+    def __init__(self, pixels, capture_time=None, pool=None, timestamp=None):
+        self.pixels = pixels
+        self.capture_time = capture_time
+        self.timestamp = timestamp
+        self.pool = pool
+        self.image = None
+        stats["frames"] += 1
+
+
+    @property
+    def shape(self):
+        return self.pixels.shape
+
+
+    @property
+    def image8u(self):
+        if self.image is None:
+            self.image = Image8U(self.pixels)
+            stats["conversions"] += 1
+        return self.image
+
+
+    def release(self):
+        if self.pixels is None:
+            return
+        if not self.pool is None:
+            self.pool.release(self.pixels)
+        self.pixels = None
+        self.image = None
+
+
+class FramePool:
+    '''
+        Reusable pixel buffers grouped by shape.
+
+        acquire() returns a free buffer or allocates a new one,
+        at most max_free buffers of every shape are kept.
+    '''
+
+    def __init__(self, max_free=16):
+        self.max_free = max_free
+        self.free = {}
+        self.lock = threading.Lock()
+
+
+    def acquire(self, shape):
+        with self.lock:
+            buffers = self.free.get(shape)
+            if buffers:
+                return buffers.pop()
+        stats["allocations"] += 1
+        return np.empty(shape, np.uint8)
+
+
+    def release(self, pixels):
+        with self.lock:
+            buffers = self.free.setdefault(pixels.shape, [])
+            if len(buffers) < self.max_free:
+                buffers.append(pixels)
+
+
+def pixels(img):
+    '''
+        Returns numpy pixels of a Frame or the array itself
+    '''
+    if type(img) is Frame:
+        return img.pixels
+    return img
@@ -0,0 +1,151 @@
+import numpy as np
+import config
+
+
+class GalleryIndex:
+    '''
+        In-memory index of enrolled descriptors.
+
+        All descriptors are kept in one contiguous matrix
+        (one row per descriptor) with a person row column,
+        so a query is scored against the whole gallery
+        with a single matrix product.
+
+        The matrix product is a cosine similarity of the raw
+        descriptor bytes, which is not the FaceSDK matcher score.
+        It is used only to shortlist candidates, search() scores
+        them with IMatcher.match, so the threshold semantics are
+        the same as in the loop version of recognize_person:
+        scores of all descriptors of a person are averaged and
+        persons with average score below the threshold are rejected.
+
+        argument descriptors:
+            - numpy array (N, D) of uint8 descriptors
+        argument person_rows:
+            - numpy array (N,) - index of the person for every descriptor
+        argument ids, names:
+            - lists of persons ids and names indexed by person row
+    '''
+
+    def __init__(self, descriptors, person_rows, ids, names, vectors=None):
+        self.ids = list(ids)
+        self.names = list(names)
+        self.descriptors = descriptors
+        self.person_rows = np.ascontiguousarray(person_rows, np.int64)
+        if vectors is None:
+            vectors = descriptors2vectors(descriptors)
+        self.matrix = vectors
+        self.counts = np.bincount(
+            self.person_rows, minlength=len(self.ids)).astype(np.float32)
+
+        # Descriptor rows grouped by person: rows of person p
+        # are order[starts[p]:starts[p + 1]]
+        self.order = np.argsort(self.person_rows, kind="stable")
+        self.starts = np.concatenate(([0], np.cumsum(self.counts.astype(np.int64))))
+
+
+    @classmethod
+    def from_persons_data(cls, persons_data):
+        '''
+            Builds the index from utils.read_persons_data() output
+        '''
+        descriptors = []
+        person_rows = []
+        ids, names = [], []
+        for row, pers in enumerate(persons_data["persons"]):
+            ids.append(pers["id"])
+            names.append(pers["name"])
+            for desc_list in pers["descriptors_raw"]:
+                descriptors.append(desc_list)
+                person_rows.append(row)
+        return cls(
+            np.array(descriptors, np.uint8).reshape(len(descriptors), -1),
+            np.array(person_rows, np.int64),
+            ids,
+            names)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def person_scores(self, query):
+        '''
+            Returns average cosine similarity
+            to the query for every person in the gallery
+        '''
+        if self.matrix.shape[0] == 0:
+            return np.zeros(0, np.float32)
+        scores = self.matrix.dot(descriptors2vectors(query)[0])
+        sums = np.bincount(
+            self.person_rows, weights=scores, minlength=len(self.ids))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg = sums / self.counts
+        return np.nan_to_num(avg, nan=0.0)
+
+
+    def shortlist(self, query, n):
+        '''
+            Returns rows of up to n persons with the best
+            average cosine similarity to the query
+        '''
+        avg = self.person_scores(query)
+        n = min(n, avg.shape[0])
+        if n == 0:
+            return np.zeros(0, np.int64)
+        top = np.argpartition(-avg, n - 1)[:n]
+        return top[np.argsort(-avg[top], kind="stable")]
+
+
+    def person_descriptors(self, row):
+        return self.descriptors[self.order[self.starts[row]:self.starts[row + 1]]]
+
+
+    def search(self, query, matcher, k=1, threshold=None, shortlist=None):
+        '''
+            Returns up to k best matched persons sorted by score:
+                [{"id": ..., "name": ..., "score": ...}, ...]
+
+            Candidates are shortlisted by the index, their score is
+            the average IMatcher.match score of their descriptors.
+            Persons scored below the threshold are skipped.
+
+            argument query:
+                - uint8 descriptor array
+            argument matcher:
+                - FaceSDK IMatcher
+        '''
+        # utils imports facetools, which imports this module
+        import utils
+
+        if threshold is None:
+            threshold = config.recognition_threshold
+        if shortlist is None:
+            shortlist = config.recognition_shortlist
+        query_desc = utils.list2desc(query)
+
+        matches = []
+        for row in self.shortlist(query, max(k, shortlist)):
+            descriptors = self.person_descriptors(row)
+            score = sum(
+                matcher.match(utils.list2desc(desc), query_desc)
+                for desc in descriptors) / len(descriptors)
+            if score >= threshold:
+                matches.append(
+                    {"id": self.ids[row], "name": self.names[row], "score": float(score)})
+        matches.sort(key=lambda match: -match["score"])
+        return matches[:k]
+
+
+def descriptors2vectors(descriptors):
+    '''
+        Converts uint8 descriptors (N, D) or (D,) to
+        L2-normalized float32 vectors, so that similarity
+        is a dot product of rows.
+    '''
+    vectors = np.atleast_2d(np.asarray(descriptors, np.uint8)).astype(np.float32)
+    vectors -= 128.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return np.ascontiguousarray(vectors)
@@ -0,0 +1,104 @@
+import config
+import utils
+
+
+class LoadGovernor:
+    '''
+        Keeps processing real-time by trading accuracy for speed.
+
+        Frame processing time is smoothed and compared with
+        the camera frame budget (1000 / fps ms, multiplied by the
+        number of frames one processed frame stands for).
+        When the load is high the governor, step by step:
+            1. refreshes emotion less often
+            2. increases the tracker detection period
+            3. skips more frames
+        When the load is low the steps are reverted in reverse order.
+        Every adjustment is logged.
+    '''
+
+    def __init__(self, ftool, fps):
+        self.ftool = ftool
+        self.budget = 1000.0 / fps if fps else 40.0
+        self.avg_ms = None
+        self.frames = 0
+        self.skip_counter = 0
+
+        self.frame_skip = 0
+        self.min_detection_period = ftool.g_tracker.detectionPeriod
+        self.min_emotion_interval = ftool.results_cache.emotion_refresh_interval
+        self.adjustments = 0
+
+
+    def frame_budget(self):
+        return self.budget * (self.frame_skip + 1)
+
+
+    def skip_frame(self):
+        '''
+            Returns True if the next frame should be skipped
+        '''
+        if self.frame_skip == 0:
+            return False
+        self.skip_counter += 1
+        if self.skip_counter > self.frame_skip:
+            self.skip_counter = 0
+            return False
+        return True
+
+
+    def update(self, frame_ms):
+        alpha = config.governor_smoothing
+        if self.avg_ms is None:
+            self.avg_ms = frame_ms
+        else:
+            self.avg_ms = (1.0 - alpha) * self.avg_ms + alpha * frame_ms
+
+        self.frames += 1
+        if self.frames % config.governor_adjust_every:
+            return
+
+        load = self.avg_ms / self.frame_budget()
+        if load > config.governor_high_load:
+            self.degrade(load)
+        elif load < config.governor_low_load:
+            self.restore(load)
+
+
+    def degrade(self, load):
+        tracker = self.ftool.g_tracker
+        cache = self.ftool.results_cache
+
+        if cache.emotion_refresh_interval < config.governor_max_emotion_interval:
+            self.set_knob("emotion refresh interval", cache, "emotion_refresh_interval",
+                min(config.governor_max_emotion_interval, cache.emotion_refresh_interval * 2), load)
+        elif tracker.detectionPeriod < config.governor_max_detection_period:
+            self.set_knob("detection period", tracker, "detectionPeriod",
+                min(config.governor_max_detection_period,
+                    tracker.detectionPeriod + config.governor_detection_period_step), load)
+        elif self.frame_skip < config.governor_max_frame_skip:
+            self.set_knob("frame skip", self, "frame_skip", self.frame_skip + 1, load)
+
+
+    def restore(self, load):
+        tracker = self.ftool.g_tracker
+        cache = self.ftool.results_cache
+
+        if self.frame_skip > 0:
+            self.set_knob("frame skip", self, "frame_skip", self.frame_skip - 1, load)
+        elif tracker.detectionPeriod > self.min_detection_period:
+            self.set_knob("detection period", tracker, "detectionPeriod",
+                max(self.min_detection_period,
+                    tracker.detectionPeriod - config.governor_detection_period_step), load)
+        elif cache.emotion_refresh_interval > self.min_emotion_interval:
+            self.set_knob("emotion refresh interval", cache, "emotion_refresh_interval",
+                max(self.min_emotion_interval, cache.emotion_refresh_interval // 2), load)
+
+
+    def set_knob(self, name, obj, attr, value, load):
+        old_value = getattr(obj, attr)
+        utils.log("Governor: load %.2f (%.1f of %.1f ms), %s %s -> %s" % (
+            load, self.avg_ms, self.frame_budget(), name, str(old_value), str(value)),
+            key="governor")
+        setattr(obj, attr, value)
+        self.adjustments += 1
@@ -1,7 +1,7 @@
 import cv2
 import numpy
 import config
-from pyfacesdk import USize
+from sdk import USize
 
 # Global tracker object
 gt_obj = None
@@ -0,0 +1,252 @@
+import atexit
+import collections
+import json
+import os
+import os.path as osp
+import sys
+import threading
+import time
+from datetime import datetime as dt
+from multiprocessing import util as mp_util
+
+import config
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+class RateLimiter:
+    '''
+        Allows up to limit records per key in every interval seconds.
+        Suppressed records are counted, the count is reported
+        with the first record of the next interval.
+    '''
+
+    MAX_KEYS = 10000
+
+    def __init__(self, limit, interval):
+        self.limit = limit
+        self.interval = interval
+        self.windows = {}
+
+
+    def allow(self, key, now):
+        '''
+            Returns (allowed, suppressed) where suppressed is the
+            number of records dropped in the previous interval
+        '''
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = 0 if window is None else window[2]
+            if window is None and len(self.windows) >= self.MAX_KEYS:
+                self.prune(now)
+            self.windows[key] = [now, 1, 0]
+            return True, suppressed
+        if window[1] < self.limit:
+            window[1] += 1
+            return True, 0
+        window[2] += 1
+        return False, 0
+
+
+    def prune(self, now):
+        self.windows = {
+            key: window for key, window in self.windows.items()
+            if now - window[0] < self.interval}
+
+
+class Logger:
+    '''
+        Non-blocking logger.
+
+        log() only filters the record by level and rate and puts
+        a tuple to a queue, formatting and output are done by the
+        writer thread in batches: text lines go to the console,
+        JSON lines (with extra fields) to the log file, which is
+        rotated when it grows to max_bytes.
+
+        Records with the same key (the message by default) are
+        rate limited, so per-frame messages can not flood the log.
+        The queue is bounded by queue_size records. Write errors
+        are reported to stderr and do not stop the writer thread.
+    '''
+
+    def __init__(self, level=None, path=None, to_file=None, max_bytes=None,
+            backups=None, rate_limit=None, rate_interval=None, stream=None,
+            queue_size=None):
+        if level is None:
+            level = config.log_level
+        if level is None:
+            level = DEBUG if config.debug_mode else INFO
+        self.level = level
+        self.path = path or config.log_file
+        self.to_file = config.log_to_file if to_file is None else to_file
+        self.max_bytes = config.log_max_bytes if max_bytes is None else max_bytes
+        self.backups = config.log_backups if backups is None else backups
+        self.limiter = RateLimiter(
+            rate_limit or config.log_rate_limit,
+            rate_interval or config.log_rate_interval)
+        self.stream = stream
+        self.queue_size = queue_size or config.log_queue_size
+
+        self.reset()
+        self.records_dropped = 0
+        self.write_errors = 0
+
+
+    def reset(self):
+        '''
+            Drops the writer thread state, it is called in forked
+            child processes, which do not inherit the thread
+        '''
+        self.cond = threading.Condition(threading.Lock())
+        self.records = collections.deque()
+        self.writing = False
+        self.thread = None
+        self.pid = None
+        self.file = None
+
+
+    def log(self, message, offset=0, level=INFO, to_file=False, key=None, **fields):
+        if level < self.level:
+            return
+        now = time.time()
+        with self.cond:
+            # Thread is (re)started lazily, so the logger
+            # also works in forked worker processes
+            if self.pid != os.getpid():
+                self.start()
+            allowed, suppressed = self.limiter.allow(message if key is None else key, now)
+            if not allowed or len(self.records) >= self.queue_size:
+                self.records_dropped += 1
+                return
+            self.records.append((now, level, message, offset, to_file, suppressed, fields))
+            self.cond.notify()
+
+
+    def start(self):
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="Logger", daemon=True)
+        self.thread.start()
+
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.records:
+                    self.cond.wait()
+                batch = list(self.records)
+                self.records.clear()
+                self.writing = True
+            try:
+                self.write(batch)
+            except Exception as e:
+                self.write_errors += 1
+                self.report_error(e, len(batch))
+            finally:
+                with self.cond:
+                    self.writing = False
+                    self.cond.notify_all()
+
+
+    def write(self, batch):
+        lines = []
+        file_lines = []
+        for created, level, message, offset, to_file, suppressed, fields in batch:
+            event_time = dt.fromtimestamp(created).time().isoformat()[0:-4]
+            text = "%s%s%s" % (event_time, " " + "\t" * offset, message)
+            if suppressed:
+                text += " (%d similar messages suppressed)" % suppressed
+            lines.append(text)
+
+            if self.to_file or to_file:
+                record = {
+                    "time": dt.fromtimestamp(created).isoformat(),
+                    "level": LEVEL_NAMES.get(level, str(level)),
+                    "message": message
+                }
+                if suppressed:
+                    record["suppressed"] = suppressed
+                record.update(fields)
+                file_lines.append(json.dumps(record, default=str))
+
+        stream = self.stream or sys.stdout
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+        if file_lines:
+            self.write_file(file_lines)
+
+
+    def report_error(self, error, records):
+        # The log itself is broken, so the error goes to stderr
+        try:
+            sys.stderr.write("Logger: %d records are not written: %s\n" % (records, str(error)))
+            sys.stderr.flush()
+        except Exception:
+            pass
+        # Log file is opened again on the next write
+        if not self.file is None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+
+    def write_file(self, file_lines):
+        if self.file is None:
+            log_dir = osp.dirname(self.path)
+            if log_dir and not osp.isdir(log_dir):
+                os.makedirs(log_dir)
+            self.file = open(self.path, 'a')
+        self.file.write("\n".join(file_lines) + "\n")
+        self.file.flush()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+
+    def rotate(self):
+        '''
+            log -> log.1 -> log.2 ... the oldest backup is removed
+        '''
+        self.file.close()
+        self.file = None
+        for n in range(self.backups - 1, 0, -1):
+            src = "%s.%d" % (self.path, n)
+            if osp.isfile(src):
+                os.replace(src, "%s.%d" % (self.path, n + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+
+    def flush(self, timeout=1.0):
+        '''
+            Waits until the queued records are written
+        '''
+        deadline = time.time() + timeout
+        with self.cond:
+            if self.pid != os.getpid():
+                return
+            while (self.records or self.writing) and time.time() < deadline:
+                self.cond.wait(max(0.0, deadline - time.time()))
+
+
+def register_flush(logger):
+    # multiprocessing workers exit without atexit handlers,
+    # their finalizers are run instead
+    mp_util.Finalize(logger, logger.flush, exitpriority=0)
+
+
+logger = Logger()
+atexit.register(logger.flush)
+register_flush(logger)
+mp_util.register_after_fork(logger, register_flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=logger.reset)
@@ -4,21 +4,241 @@ import sys
 import cv2
 import os.path as osp
 import numpy as np
-from pyfacesdk import *
+from sdk import *
 
 import camtools
 import facetools
 import utils
 import config
 import guitools
+import timing
+import compositor
+import visits
+import reid
+import governor
+import frames
+import videolog
+import logger
+import scheduler
+import framebus
+
+
+def process_frame(ftool, frame, timestamp, journal=None, visitors=None, known=None):
+	'''
+		Tracks faces on the frame (frames.Frame) and classifies every tracklet.
+		The frame is converted to Image8U at most once.
+		Finished tracklets are recorded to the visits journal.
+		Returns (tracklets, analysis) - see FaceToolkit.analyze
+	'''
+	# Traking faces globally
+	with timing.timer.stage("tracker"):
+		tracklets = ftool.track(frame, timestamp)
+
+	# Classifying faces on the clean full resolution frame before drawing on it.
+	# Frame is converted and points are calculated only once per tracklet,
+	# stable results are cached until the tracker drops the tracklet
+	with timing.timer.stage("analysis"):
+		if config.async_classifiers:
+			# Last known results, classification runs on worker threads
+			analysis = ftool.analyze_async(frame, tracklets, timestamp)
+		else:
+			analysis = ftool.analyze(frame, tracklets, timestamp, frame)
+
+	record_visits(ftool, journal, visitors, known)
+	return tracklets, analysis
+
+
+def record_visits(ftool, journal, visitors=None, known=None):
+	'''
+		Writes finished tracklets to the visits journal.
+		If visitors gallery is given, returning visitors are
+		re-identified by the best frame descriptor.
+		If known persons gallery (gallery.GalleryIndex) is given,
+		the visit is marked with the recognized person.
+		Identified visits are recorded by the visit worker,
+		all of them are recorded when ftool is closed.
+	'''
+	for entry in ftool.pop_finished():
+		if journal is None:
+			continue
+		if entry.last_seen - entry.first_seen < config.visit_min_duration:
+			continue
+
+		if visitors is None and known is None:
+			visits.record_visit(journal, entry, journal.new_visitor_id())
+		else:
+			# Descriptor extraction and matching run off the frame loop
+			ftool.get_visit_worker().submit(entry, journal, visitors, known)
+
+
+def tracklet_info(tlet_id, results):
+	'''
+		Lines of the tracklet block on the info panel
+		from its analysis results (or tracklet record)
+	'''
+	info = {
+		"Person": tlet_id,
+		"sep1": "___",
+		"Attributes: ": "",
+	}
+	info.update(results["attributes"])
+	info.update({
+		"sep2": "___",
+		"Demographics: ": "",
+	})
+	info.update(results["demographics"])
+	info.update({
+		"sep3": "___",
+		"Emotion": results["emotion"]
+	})
+	return info
 
 
 def main():
 	'''
 		All the magic starts here.
 	'''
+	if "--headless" in sys.argv:
+		config.headless = True
+	if "--bus" in sys.argv:
+		config.frame_bus = True
+	if config.headless and config.results_file == "-":
+		# Startup messages are logged before results are opened
+		logger.logger.stream = sys.stderr
+
+	if config.frame_bus:
+		framebus.run(config.video_source, config.headless, config.results_file)
+		return
+
 	cam = camtools.CamToolkit(config.video_source)
 	ftool = facetools.FaceToolkit(cam.video_dict)
+	if config.models_warm_up:
+		ftool.warm_up()
+	ftool.model_report()
+
+	journal = visitors = None
+	if config.count_visits:
+		journal = visits.VisitJournal()
+		journal.start()
+		if config.reid_enabled:
+			visitors = reid.VisitorGallery()
+
+	recorder = None
+	if config.write_videolog and not config.headless:
+		recorder = videolog.VideoLogRecorder(cam.fps)
+		recorder.start()
+
+	if config.headless:
+		run_headless(cam, ftool, journal, visitors)
+	else:
+		run_gui(cam, ftool, journal, visitors, recorder)
+
+	# Visitors still in front of the camera are counted too
+	ftool.finish_all()
+	record_visits(ftool, journal, visitors)
+
+	utils.log("Capture stats: %s" % str(cam.stats()), level=logger.DEBUG)
+	utils.log("Frames stats: %s" % str(frames.stats), level=logger.DEBUG)
+	if not ftool.classifier_pool is None:
+		utils.log("Classifier pool stats: %s" % str(ftool.classifier_pool.stats()), level=logger.DEBUG)
+	ftool.close()
+	cam.release()
+	if not recorder is None:
+		recorder.close()
+		utils.log("Video log stats: %s" % str(recorder.stats()))
+	if not journal is None:
+		journal.close()
+		utils.log("Visits counted: %d, returning: %d" % (
+			journal.counter.state["visits"], journal.counter.state.get("returning", 0)))
+
+
+def open_results_file(path):
+	'''
+		Opens the results file: "-" means stdout, None - results
+		are not written. When results go to stdout, console log
+		goes to stderr, so stdout stays parseable JSON lines
+	'''
+	if path is None:
+		return None
+	if path == "-":
+		logger.logger.stream = sys.stderr
+		return sys.stdout
+	return open(path, 'a')
+
+
+def run_headless(cam, ftool, journal=None, visitors=None, known=None):
+	'''
+		Processing without any GUI and drawing.
+		Frames are processed as fast as possible and results
+		are written as JSON lines to config.results_file
+		("-" means stdout, None - results are not written)
+	'''
+	cur_timestamp = 0
+	frames_num = 0
+	start_time = time.time()
+
+	results_file = open_results_file(config.results_file)
+
+	# Files are processed as fast as possible, only live
+	# sources have to keep up with the camera
+	load_governor = None
+	if config.governor_enabled and not cam.is_file:
+		load_governor = governor.LoadGovernor(ftool, cam.fps)
+	frame_scheduler = None
+	if config.scheduler_enabled:
+		frame_scheduler = scheduler.FrameScheduler(cam.fps, not cam.is_file)
+
+	while True:
+		with timing.timer.stage("capture"):
+			frame = cam.get_frame()
+		if frame is None:
+			break
+
+		# Timestamp of the frame in the stream
+		cur_timestamp = frame.timestamp
+		if not frame_scheduler is None and frame_scheduler.is_stale(frame):
+			frame.release()
+			continue
+		if not load_governor is None and load_governor.skip_frame():
+			frame.release()
+			continue
+
+		frames_num += 1
+		frame_start = time.perf_counter()
+		capture_time = frame.capture_time
+		tracklets, analysis = process_frame(ftool, frame, cur_timestamp, journal, visitors, known)
+		frame.release()
+		frame_ms = (time.perf_counter() - frame_start) * 1000.0
+		timing.timer.record("frame", frame_ms)
+		if not load_governor is None:
+			load_governor.update(frame_ms)
+		if not frame_scheduler is None:
+			frame_scheduler.shown(capture_time)
+			frame_scheduler.update(frame_ms)
+		timing.timer.maybe_report()
+		if len(tracklets) < 1 or results_file is None:
+			continue
+
+		record = {
+			"timestamp": cur_timestamp,
+			"tracklets": [
+				utils.tracklet_record(tlet, analysis[tlet.id], cur_timestamp, ftool.tlet_rect(tlet))
+				for tlet in tracklets]
+		}
+		results_file.write(json.dumps(record) + "\n")
+
+	if not results_file is None and not results_file is sys.stdout:
+		results_file.close()
+
+	elapsed = time.time() - start_time
+	utils.log("Processed %d frames in %.1f s (%.1f fps)" %
+		(frames_num, elapsed, frames_num / max(elapsed, 1e-6)))
+	if not frame_scheduler is None:
+		utils.log("Scheduler stats: %s" % str(frame_scheduler.stats()))
+	timing.timer.report()
+
+
+def run_gui(cam, ftool, journal=None, visitors=None, recorder=None):
 
 	# ======= Initializing GUI =======
 	guitools.gt_obj = ftool.g_tracker
@@ -26,26 +246,46 @@ def main():
 
 	# ============ GUI ===============
 
-	frame = cam.get_frame()
-
 	time_step = int(1000 / cam.fps)
 	cur_timestamp = 0
+	overlay = compositor.OverlayCompositor()
 
-	while not frame is None:
+	# Recorded footage is analyzed completely, even if playback is slower
+	load_governor = None
+	if config.governor_enabled and not cam.is_file:
+		load_governor = governor.LoadGovernor(ftool, cam.fps)
+	frame_scheduler = None
+	if config.scheduler_enabled:
+		frame_scheduler = scheduler.FrameScheduler(cam.fps, not cam.is_file)
+
+	while True:
 		
 		# Get new frame from camera
-		frame = cam.get_frame()
-		frame8u = Image8U(frame)
-
-		# Updating timestamp for global tracker
-		cur_timestamp += time_step
+		with timing.timer.stage("capture"):
+			frame = cam.get_frame()
+		if frame is None:
+			break
+		frame_start = time.perf_counter()
 
-		# Traking faces globally
-		ftool.g_tracker.process(frame8u, cur_timestamp)
+		# Timestamp for global tracker is the real capture position
+		cur_timestamp = frame.timestamp
 
-		tracklets = ftool.g_tracker.tracklets
+		# Stale frames are dropped before they reach the tracker
+		if not frame_scheduler is None and frame_scheduler.is_stale(frame):
+			frame.release()
+			continue
+		if not load_governor is None and load_governor.skip_frame():
+			frame.release()
+			continue
 
+		capture_time = frame.capture_time
+		tracklets, analysis = process_frame(ftool, frame, cur_timestamp, journal, visitors)
 
+		# Drawing goes directly to the output canvas,
+		# the captured frame buffer can be reused after copying
+		canvas_frame = overlay.begin(frame.pixels)
+		frame.release()
+		frame = canvas_frame
 		tracklets_info = {}
 
 		for i, tlet in enumerate(tracklets):
@@ -66,51 +306,47 @@ def main():
 			tlet_age = cur_timestamp - int(tlet.start_time)
 			tlet_state = str(tlet.state)
 
-			frame = utils.draw_tracklet_on_frame(
-				frame,
-				tlet,
-				tlet_age=tlet_age,
-				tlet_state=tlet_state)
+			with timing.timer.stage("draw"):
+				frame = utils.draw_tracklet_on_frame(
+					frame,
+					tlet,
+					tlet_age=tlet_age,
+					tlet_state=tlet_state,
+					rect=ftool.tlet_rect(tlet))
 
 
-			tlet_key = "Person %d" % tlet.id 
-			tracklets_info.update({
-				tlet_key :  
-					{
-						"sep1": "___",
-						"Attributes: ": "",
-					}
-				})
+			tracklets_info["Person %d" % tlet.id] = tracklet_info(tlet.id, analysis[tlet.id])
 
-			attributes = ftool.get_attributes(frame, facerect=tlet)
-			tracklets_info[tlet_key].update(attributes)
 
-			
-			tracklets_info[tlet_key].update({
-					"sep2": "___",
-					"Demographics: ": "",
-				})
-			demographics = ftool.get_demographics(frame, facerect=tlet)
-			tracklets_info[tlet_key].update(demographics)
-
-
-			emotion = ftool.get_emotion(frame, facerect=tlet)
-			tracklets_info[tlet_key].update({
-					"sep3": "___",
-					"Emotion": emotion
-				})
-			
-			info_bar = utils.create_blank_image(
-				int(frame.shape[0]),
-				int(frame.shape[1] * 0.4))
-			info_bar = utils.put_text_from_dict_on_image(info_bar, tracklets_info[tlet_key], "left-top")
+		with timing.timer.stage("info_bar"):
+			overlay.draw_panel([
+				(tlet.id, tracklets_info["Person %d" % tlet.id])
+				for tlet in tracklets])
+
+		with timing.timer.stage("display"):
+			cv2.imshow("Frames from camera", overlay.canvas)
+		if not frame_scheduler is None:
+			frame_scheduler.shown(capture_time)
 
+		if not recorder is None:
+			with timing.timer.stage("videolog"):
+				recorder.put(overlay.canvas)
 
+		frame_ms = (time.perf_counter() - frame_start) * 1000.0
+		timing.timer.record("frame", frame_ms)
+		if not load_governor is None:
+			load_governor.update(frame_ms)
+		timing.timer.maybe_report()
 
-		frame = np.concatenate((info_bar, frame), axis=1)
-		cv2.imshow("Frames from camera", frame)
+		# Wait is what is left of the frame period, not a fixed time step
+		if frame_scheduler is None:
+			pressed_key = cv2.waitKey(time_step)
+		else:
+			frame_scheduler.update(frame_ms)
+			pressed_key = cv2.waitKey(frame_scheduler.wait_ms())
 
-		pressed_key = cv2.waitKey(time_step)
+	if not frame_scheduler is None:
+		utils.log("Scheduler stats: %s" % str(frame_scheduler.stats()))
 
 
 
@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+import config
+from sdk import IRect
+
+
+class FramePreprocessor:
+    '''
+        Prepares the tracker input: crops the frame to ROI
+        and downscales it by config.tracker_input_scale into
+        a reused buffer.
+
+        Tracklets positions are in the tracker input space,
+        to_frame() maps them back to the full frame, so
+        classifiers and drawing work at full resolution.
+
+        argument video_params:
+            - dict in CamToolkit.video_dict format,
+              "roi" is (x, y, w, h) in frame coordinates or None
+    '''
+
+    def __init__(self, video_params, scale=None):
+        self.frame_w = video_params["w"]
+        self.frame_h = video_params["h"]
+        if video_params["roi"] is None:
+            self.roi = (0, 0, self.frame_w, self.frame_h)
+        else:
+            self.roi = tuple(int(v) for v in video_params["roi"])
+        self.scale = float(config.tracker_input_scale if scale is None else scale)
+
+        roi_w, roi_h = self.roi[2], self.roi[3]
+        self.input_w = max(1, int(roi_w * self.scale))
+        self.input_h = max(1, int(roi_h * self.scale))
+        self.fps = video_params["fps"]
+        self.buffer = np.empty((self.input_h, self.input_w, 3), np.uint8)
+
+
+    def is_identity(self):
+        return self.scale == 1.0 and self.roi == (0, 0, self.frame_w, self.frame_h)
+
+
+    def tracker_video_dict(self):
+        '''
+            Video params of the tracker input for FaceToolkit
+        '''
+        return {
+            "w": self.input_w,
+            "h": self.input_h,
+            "fps": self.fps,
+            "roi": None
+        }
+
+
+    def prepare(self, frame):
+        if self.is_identity():
+            return frame
+        x, y, w, h = self.roi
+        crop = frame[y:y + h, x:x + w]
+        if self.scale == 1.0:
+            # ROI view is not contiguous, it is copied to the buffer
+            np.copyto(self.buffer, crop)
+            return self.buffer
+        cv2.resize(
+            crop,
+            (self.input_w, self.input_h),
+            dst=self.buffer,
+            interpolation=cv2.INTER_AREA)
+        return self.buffer
+
+
+    def to_frame(self, rect):
+        '''
+            Maps a rect (IRect or tracklet position)
+            from the tracker input to the frame coordinates
+        '''
+        x, y = self.roi[0], self.roi[1]
+        return IRect(
+            int(x + rect.x / self.scale),
+            int(y + rect.y / self.scale),
+            int(rect.w / self.scale),
+            int(rect.h / self.scale))
@@ -0,0 +1,67 @@
+import bisect
+
+import config
+
+
+def quality_score(quality):
+    '''
+        Converts IQualityEvaluator result to a single
+        score in [0, 1]. Returns None if any of the checks
+        does not pass config thresholds.
+    '''
+    blurriness = quality.blurriness
+    yaw, pitch = abs(quality.angles.yaw), abs(quality.angles.pitch)
+    resolution = quality.resolution
+
+    if blurriness > config.quality_max_blurriness:
+        return None
+    if yaw > config.quality_max_yaw or pitch > config.quality_max_pitch:
+        return None
+    if resolution < config.quality_min_resolution:
+        return None
+
+    sharpness = 1.0 - blurriness
+    frontality = (1.0 - yaw / 90.0) * (1.0 - pitch / 90.0)
+    size = min(1.0, float(resolution) / (2 * config.quality_min_resolution))
+    return sharpness * frontality * size
+
+
+class BestFrames:
+    '''
+        Per-tracklet buffer of N best quality frames.
+
+        Items are (score, timestamp, crop, facerect), where crop
+        is a copy of the face area (or None) and facerect
+        is the face IRect inside the crop.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.items = []
+
+
+    def accepts(self, score):
+        if len(self.items) < self.size:
+            return True
+        return score > self.items[0][0]
+
+
+    def offer(self, score, timestamp, crop=None, facerect=None):
+        '''
+            Returns True if the frame is one of the N best so far
+        '''
+        if not self.accepts(score):
+            return False
+        if len(self.items) >= self.size:
+            self.items.pop(0)
+        keys = [item[0] for item in self.items]
+        self.items.insert(
+            bisect.bisect_left(keys, score),
+            (score, timestamp, crop, facerect))
+        return True
+
+
+    def best(self):
+        if not self.items:
+            return None
+        return self.items[-1]
@@ -0,0 +1,139 @@
+import time
+
+import numpy as np
+
+import config
+import utils
+from gallery import descriptors2vectors
+
+
+class VisitorGallery:
+    '''
+        Rolling gallery of recent visitors descriptors
+        for re-identification of returning visitors.
+
+        Vectors are kept in a preallocated matrix of
+        capacity rows, so memory is bounded. A query is
+        scored against all rows with one matrix product,
+        the best rows are shortlisted and scored by the
+        FaceSDK matcher against the latest descriptor of
+        the visitor, the threshold applies to that score.
+        Rows not updated for longer than max_age seconds
+        are expired, when the gallery is full the least
+        recently seen visitor is replaced.
+    '''
+
+    def __init__(self, capacity=None, max_age=None, threshold=None, update_rate=None, shortlist=None):
+        self.capacity = capacity or config.reid_capacity
+        self.max_age = config.reid_max_age if max_age is None else max_age
+        self.threshold = config.reid_threshold if threshold is None else threshold
+        self.update_rate = config.reid_update_rate if update_rate is None else update_rate
+        self.shortlist = shortlist or config.reid_shortlist
+
+        # Allocated on the first descriptor, when its size is known
+        self.matrix = None
+        self.descriptors = None
+        self.visitor_ids = np.zeros(self.capacity, np.int64)
+        self.last_seen = np.full(self.capacity, -np.inf)
+        # Rows [0, used) were ever filled
+        self.used = 0
+        self.size = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        expired = self.last_seen[:self.used] < now - self.max_age
+        expired &= np.isfinite(self.last_seen[:self.used])
+        self.last_seen[:self.used][expired] = -np.inf
+        self.size -= int(expired.sum())
+
+
+    def match(self, descriptor, matcher):
+        '''
+            Returns (row, score) of the best matched visitor
+            or (None, score) if nobody passes the threshold
+
+            argument matcher:
+                - FaceSDK IMatcher
+        '''
+        if self.size == 0:
+            return None, 0.0
+        vector = descriptors2vectors(descriptor)[0]
+        scores = self.matrix[:self.used].dot(vector)
+        scores[~np.isfinite(self.last_seen[:self.used])] = -np.inf
+        n = min(self.shortlist, self.size)
+        query = utils.list2desc(descriptor)
+
+        best_row, best_score = None, 0.0
+        for row in np.argpartition(-scores, n - 1)[:n]:
+            score = matcher.match(utils.list2desc(self.descriptors[row]), query)
+            if best_row is None or score > best_score:
+                best_row, best_score = int(row), score
+        if best_score < self.threshold:
+            return None, best_score
+        return best_row, best_score
+
+
+    def free_row(self):
+        if self.used < self.capacity:
+            self.used += 1
+            return self.used - 1
+        # Expired row or the least recently seen visitor
+        return int(np.argmin(self.last_seen))
+
+
+    def add(self, descriptor, visitor_id, now):
+        vector = descriptors2vectors(descriptor)[0]
+        if self.matrix is None:
+            self.matrix = np.zeros((self.capacity, vector.shape[0]), np.float32)
+            self.descriptors = np.zeros((self.capacity, vector.shape[0]), np.uint8)
+        row = self.free_row()
+        if np.isfinite(self.last_seen[row]):
+            self.size -= 1
+        self.matrix[row] = vector
+        self.descriptors[row] = descriptor
+        self.visitor_ids[row] = visitor_id
+        self.last_seen[row] = now
+        self.size += 1
+        return row
+
+
+    def update(self, row, descriptor, now):
+        # Moving average of the visitor descriptor
+        vector = descriptors2vectors(descriptor)[0]
+        blended = (1.0 - self.update_rate) * self.matrix[row] + self.update_rate * vector
+        norm = np.linalg.norm(blended)
+        if norm > 0:
+            blended /= norm
+        self.matrix[row] = blended
+        # Matcher scores the latest descriptor of the visitor
+        self.descriptors[row] = descriptor
+        self.last_seen[row] = now
+
+
+    def identify(self, descriptor, new_visitor_id, matcher, now=None):
+        '''
+            Finds the visitor in the gallery or adds a new one.
+
+            argument new_visitor_id:
+                - function returning id for a new visitor
+            argument matcher:
+                - FaceSDK IMatcher
+
+            Returns (visitor_id, is_returning)
+        '''
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        row, score = self.match(descriptor, matcher)
+        if row is None:
+            visitor_id = new_visitor_id()
+            self.add(descriptor, visitor_id, now)
+            return visitor_id, False
+        self.update(row, descriptor, now)
+        return int(self.visitor_ids[row]), True
@@ -0,0 +1,106 @@
+import time
+
+import config
+import timing
+
+
+class FrameScheduler:
+    '''
+        Deadline-based pacing of the frame loop.
+
+        Every frame gets a deadline: capture_time + max_latency.
+        Before tracking, the frame of a live source is dropped if
+        the smoothed processing time says it would be shown after
+        the deadline anyway (stale frame), the next captured frame
+        is fresher. Video files are never dropped.
+
+        The GUI wait is computed from the remaining frame period
+        instead of a fixed time step: video files are played at
+        their fps, live sources are paced by the camera itself.
+
+        Capture to display latency is recorded to timing.timer
+        as the "latency" stage.
+    '''
+
+    def __init__(self, fps, live, max_latency=None, max_dropped=None):
+        self.period = 1000.0 / fps if fps else 40.0
+        self.live = live
+        self.max_latency = (config.scheduler_max_latency if max_latency is None else max_latency) / 1000.0
+        self.max_dropped = config.scheduler_max_dropped if max_dropped is None else max_dropped
+        self.avg_ms = None
+        self.last_shown = None
+        self.dropped_in_row = 0
+
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.frames_late = 0
+        self.max_latency_seen = 0.0
+
+
+    def is_stale(self, frame):
+        '''
+            Returns True if the frame should be dropped
+            before tracking
+        '''
+        if not self.live or frame.capture_time is None or self.avg_ms is None:
+            return False
+        expected_shown = time.monotonic() + self.avg_ms / 1000.0
+        if expected_shown <= frame.capture_time + self.max_latency:
+            self.dropped_in_row = 0
+            return False
+        # Some frames are processed even if all of them are late,
+        # otherwise nothing would be shown at all
+        if self.dropped_in_row >= self.max_dropped:
+            self.dropped_in_row = 0
+            return False
+        self.dropped_in_row += 1
+        self.frames_dropped += 1
+        return True
+
+
+    def update(self, frame_ms):
+        '''
+            Updates the smoothed processing time of a frame
+        '''
+        alpha = config.scheduler_smoothing
+        if self.avg_ms is None:
+            self.avg_ms = frame_ms
+        else:
+            self.avg_ms = (1.0 - alpha) * self.avg_ms + alpha * frame_ms
+
+
+    def shown(self, capture_time):
+        '''
+            Records the capture to display latency of the frame
+        '''
+        now = time.monotonic()
+        self.last_shown = now
+        self.frames_shown += 1
+        if capture_time is None:
+            return
+        latency = now - capture_time
+        timing.timer.record("latency", latency * 1000.0)
+        self.max_latency_seen = max(self.max_latency_seen, latency)
+        if latency > self.max_latency:
+            self.frames_late += 1
+
+
+    def wait_ms(self):
+        '''
+            Returns the GUI wait time (ms), so the next frame is
+            shown one period after the last one (its processing time
+            included). At least 1 ms, so the window events are processed
+        '''
+        if self.live or self.last_shown is None or self.avg_ms is None:
+            return 1
+        elapsed = (time.monotonic() - self.last_shown) * 1000.0
+        return max(1, int(self.period - elapsed - self.avg_ms))
+
+
+    def stats(self):
+        return {
+            "shown": self.frames_shown,
+            "dropped": self.frames_dropped,
+            "late": self.frames_late,
+            "max_latency_ms": round(self.max_latency_seen * 1000.0, 1)
+        }
@@ -0,0 +1,19 @@
+'''
+    FaceSDK backend selection.
+
+    All modules import SDK names from here:
+        from sdk import *
+
+    config.sdk_backend (or FACESDK_BACKEND environment variable):
+        "pyfacesdk" - Tevian FaceSDK
+        "fake" - deterministic stand-in from fakesdk.py
+'''
+import os as _os
+import config as _config
+
+backend = _os.environ.get("FACESDK_BACKEND", _config.sdk_backend)
+
+if backend == "fake":
+    from fakesdk import *
+else:
+    from pyfacesdk import *
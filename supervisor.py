@@ -0,0 +1,299 @@
+'''
+    Multi-camera supervisor.
+
+    Runs an isolated capture + tracking pipeline for every camera
+    from config.video_sources in its own process, restarts crashed
+    workers and aggregates visits of all cameras in one journal.
+
+    Usage:
+        python supervisor.py
+'''
+import multiprocessing as mp
+import os
+import os.path as osp
+import queue
+import signal
+import time
+
+import config
+import utils
+
+
+class WorkerJournal:
+    '''
+        Visits journal used by worker processes.
+
+        Has the interface of visits.VisitJournal used by
+        main.record_visits: events are sent to the supervisor,
+        visitor ids are taken from the counter shared by all
+        workers, so they are unique across cameras.
+    '''
+
+    def __init__(self, events, visitor_ids):
+        self.events = events
+        self.visitor_ids = visitor_ids
+
+
+    def new_visitor_id(self):
+        with self.visitor_ids.get_lock():
+            self.visitor_ids.value += 1
+            return self.visitor_ids.value
+
+
+    def record(self, event):
+        self.events.put(("visit", event))
+
+
+def set_affinity(cpus):
+    '''
+        Pins the current process to the given cores if the
+        platform supports it. Returns True if the affinity was set.
+    '''
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def camera_worker(camera, events, visitor_ids, recognize):
+    '''
+        Worker process entry point: headless pipeline for one camera
+    '''
+    # Supervisor stops workers with SIGTERM, the pipeline
+    # is finished the same way as by Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    import cv2
+    import camtools
+    import descstore
+    import facetools
+    import main
+    import reid
+    import timing
+
+    name = camera["name"]
+    if set_affinity(camera.get("cpus")):
+        cv2.setNumThreads(len(camera["cpus"]))
+        utils.log("[%s] pinned to cpus %s" % (name, str(camera["cpus"])))
+
+    config.camera_name = name
+    config.video_source = camera["source"]
+    config.results_file = camera.get("results_file")
+    if config.timing_report_path:
+        root, ext = osp.splitext(config.timing_report_path)
+        timing.timer.report_path = "%s_%s%s" % (root, name, ext)
+
+    # Packed gallery files are memory-mapped,
+    # so all workers share them in the page cache
+    known = None
+    if recognize:
+        known = descstore.load_gallery()
+
+    cam = camtools.CamToolkit(camera["source"])
+    ftool = facetools.FaceToolkit(cam.video_dict)
+    if not known is None:
+        ftool.keep_best_crops = config.count_visits
+    if config.models_warm_up:
+        ftool.warm_up()
+    journal = None
+    visitors = None
+    if config.count_visits:
+        journal = WorkerJournal(events, visitor_ids)
+        if config.reid_enabled:
+            visitors = reid.VisitorGallery()
+
+    try:
+        main.run_headless(cam, ftool, journal, visitors, known)
+    except KeyboardInterrupt:
+        utils.log("[%s] stopped" % name)
+    finally:
+        # Visitors still in front of the camera are counted too
+        ftool.finish_all()
+        main.record_visits(ftool, journal, visitors, known)
+        ftool.close()
+        cam.release()
+
+
+class Worker:
+    '''
+        Supervisor side state of one camera worker
+    '''
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.name = camera["name"]
+        self.process = None
+        self.restarts = 0
+        self.restart_time = None
+        self.finished = False
+
+
+    def is_file(self):
+        return isinstance(self.camera["source"], str) and osp.isfile(self.camera["source"])
+
+
+class Supervisor:
+    '''
+        Starts one worker process per camera and watches them.
+
+        Crashed workers (non-zero exit code) are restarted after
+        config.supervisor_restart_delay seconds. Live sources are
+        restarted after a clean exit too (the stream was lost),
+        video files are done when the worker exits cleanly.
+    '''
+
+    def __init__(self, cameras=None):
+        import visits
+        cameras = config.video_sources if cameras is None else cameras
+        names = [camera["name"] for camera in cameras]
+        if len(set(names)) != len(names):
+            raise ValueError("Camera names must be unique: %s" % str(names))
+
+        # Workers are started with spawn, so they do not
+        # inherit threads and SDK state of the supervisor
+        self.context = mp.get_context("spawn")
+        self.events = self.context.Queue()
+        self.workers = [Worker(camera) for camera in cameras]
+        self.journal = None
+        last_visitor_id = 0
+        if config.count_visits:
+            self.journal = visits.VisitJournal()
+            self.journal.start()
+            last_visitor_id = self.journal.counter.state["last_visitor_id"]
+        self.visitor_ids = self.context.Value('q', last_visitor_id)
+        self.recognize = self.prepare_gallery()
+
+
+    def prepare_gallery(self):
+        '''
+            Returns True if a known persons gallery exists. Vectors
+            of the packed gallery are cached once here, not by
+            every worker at the same time.
+        '''
+        import descstore
+        store = descstore.DescriptorStore()
+        if store.exists():
+            store.load_vectors(store.load()[0])
+            return True
+        if osp.isfile(config.persons_json_path):
+            utils.log("Packed gallery not found, every worker reads %s "
+                "(run python descstore.py migrate)" % config.persons_json_path)
+            return True
+        utils.log("No known persons gallery found, recognition is disabled")
+        return False
+
+
+    def start_worker(self, worker):
+        worker.process = self.context.Process(
+            target=camera_worker,
+            args=(worker.camera, self.events, self.visitor_ids, self.recognize),
+            name="camera-%s" % worker.name,
+            daemon=True)
+        worker.process.start()
+        worker.restart_time = None
+        utils.log("[%s] worker started, pid %d" % (worker.name, worker.process.pid))
+
+
+    def check_worker(self, worker, now):
+        if worker.finished:
+            return
+        process = worker.process
+        if not process is None and process.is_alive():
+            return
+
+        if worker.restart_time is None:
+            exitcode = process.exitcode
+            if exitcode == 0 and worker.is_file():
+                worker.finished = True
+                utils.log("[%s] video file processed" % worker.name)
+                return
+            if not config.supervisor_max_restarts is None \
+                    and worker.restarts >= config.supervisor_max_restarts:
+                worker.finished = True
+                utils.log("[%s] worker exited with code %s, restarts limit reached" %
+                    (worker.name, str(exitcode)))
+                return
+            worker.restart_time = now + config.supervisor_restart_delay
+            utils.log("[%s] worker exited with code %s, restarting in %.1f s" %
+                (worker.name, str(exitcode), config.supervisor_restart_delay))
+        elif now >= worker.restart_time:
+            worker.restarts += 1
+            self.start_worker(worker)
+
+
+    def drain_events(self, timeout):
+        try:
+            kind, data = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            if kind == "visit" and not self.journal is None:
+                self.journal.record(data)
+            try:
+                kind, data = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+
+    def report(self):
+        states = []
+        for worker in self.workers:
+            if worker.finished:
+                state = "finished"
+            elif not worker.process is None and worker.process.is_alive():
+                state = "running"
+            else:
+                state = "restarting"
+            states.append("%s: %s (restarts %d)" % (worker.name, state, worker.restarts))
+        utils.log("Workers: " + ", ".join(states))
+        if not self.journal is None:
+            state = self.journal.counter.state
+            utils.log("Visits: %d, returning: %d, by camera: %s" % (
+                state["visits"], state.get("returning", 0), str(state["by_camera"])))
+
+
+    def run(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        last_report = time.time()
+        try:
+            while not all(worker.finished for worker in self.workers):
+                self.drain_events(timeout=0.5)
+                now = time.time()
+                for worker in self.workers:
+                    self.check_worker(worker, now)
+                if now - last_report >= config.supervisor_report_interval:
+                    self.report()
+                    last_report = now
+        except KeyboardInterrupt:
+            utils.log("Stopping workers")
+        self.stop()
+
+
+    def stop(self, timeout=10.0):
+        for worker in self.workers:
+            if not worker.process is None and worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            while worker.process.is_alive() and time.time() < deadline:
+                # Workers can not exit while the events queue is full
+                self.drain_events(timeout=0.1)
+            worker.process.join(max(0.0, deadline - time.time()))
+            if worker.process.is_alive():
+                worker.process.kill()
+        self.drain_events(timeout=0.1)
+
+        self.report()
+        if not self.journal is None:
+            self.journal.close()
+
+
+if __name__ == "__main__":
+    if not config.video_sources:
+        print("No cameras found in config.video_sources")
+    else:
+        Supervisor().run()
@@ -0,0 +1,212 @@
+import json
+import math
+import os
+import threading
+import time
+
+import config
+import utils
+
+
+class Histogram:
+    '''
+        Latency histogram with logarithmic buckets.
+
+        Bucket bounds grow by GROWTH factor starting from MIN_MS,
+        so percentiles have ~5% relative error and recording
+        a value is O(1) without allocations.
+    '''
+
+    MIN_MS = 0.01
+    GROWTH = 1.1
+    BUCKETS = 200
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.log_growth = math.log(self.GROWTH)
+
+
+    def record(self, ms):
+        if ms <= self.MIN_MS:
+            bucket = 0
+        else:
+            bucket = min(
+                int(math.log(ms / self.MIN_MS) / self.log_growth) + 1,
+                self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket, num in enumerate(self.counts):
+            seen += num
+            if seen >= rank and num:
+                # Upper bound of the bucket
+                return min(self.MIN_MS * self.GROWTH ** bucket, self.max)
+        return self.max
+
+
+    def summary(self, elapsed):
+        return {
+            "count": self.count,
+            "calls_per_sec": round(self.count / elapsed, 2) if elapsed > 0 else 0.0,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3)
+        }
+
+
+class Stage:
+    '''
+        Context manager measuring one call of a stage
+    '''
+
+    def __init__(self, timer, name, tracklet):
+        self.timer = timer
+        self.name = name
+        self.tracklet = tracklet
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.timer.record(
+            self.name,
+            (time.perf_counter() - self.start) * 1000.0,
+            self.tracklet)
+        return False
+
+
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        return False
+
+
+class StageTimer:
+    '''
+        Collects latency histograms per pipeline stage
+        and per tracklet.
+
+        Every report_interval seconds maybe_report() logs
+        p50/p95/p99 and calls/sec of every stage through
+        utils.log and writes the same summary as JSON
+        to report_path.
+
+        Stages are recorded from classifier and visit worker
+        threads too, all histograms are guarded by the lock.
+
+        Usage:
+            with timing.timer.stage("tracker"):
+                ftool.g_tracker.process(frame8u, timestamp)
+    '''
+
+    def __init__(self, enabled=True, report_interval=60.0, report_path=None):
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.report_path = report_path
+        self.null_stage = NullStage()
+        self.lock = threading.RLock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.tracklets = {}
+            self.start_time = time.time()
+            self.last_report = self.start_time
+
+
+    def stage(self, name, tracklet=None):
+        if not self.enabled:
+            return self.null_stage
+        return Stage(self, name, tracklet)
+
+
+    def record(self, name, ms, tracklet=None):
+        with self.lock:
+            hist = self.stages.get(name)
+            if hist is None:
+                hist = self.stages[name] = Histogram()
+            hist.record(ms)
+
+            if not tracklet is None:
+                hist = self.tracklets.get(tracklet)
+                if hist is None:
+                    hist = self.tracklets[tracklet] = Histogram()
+                hist.record(ms)
+
+
+    def forget_tracklet(self, tracklet):
+        with self.lock:
+            self.tracklets.pop(tracklet, None)
+
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            return {
+                "elapsed": round(elapsed, 3),
+                "stages": {
+                    name: hist.summary(elapsed)
+                    for name, hist in self.stages.items()},
+                "tracklets": {
+                    str(tlet_id): hist.summary(elapsed)
+                    for tlet_id, hist in self.tracklets.items()}
+            }
+
+
+    def maybe_report(self):
+        if not self.enabled:
+            return
+        now = time.time()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        self.report()
+
+
+    def report(self):
+        # Every summary covers only its own interval,
+        # stages recorded meanwhile go to the next one
+        with self.lock:
+            summary = self.summary()
+            self.reset()
+        utils.log("Timings for the last %.1f s (ms):" % summary["elapsed"])
+        for name, stat in sorted(summary["stages"].items()):
+            utils.log("%-16s p50 %8.2f  p95 %8.2f  p99 %8.2f  %8.1f calls/s" % (
+                name, stat["p50"], stat["p95"], stat["p99"], stat["calls_per_sec"]),
+                offset=1)
+
+        if self.report_path:
+            tmp_path = self.report_path + ".tmp"
+            with open(tmp_path, 'w') as report_file:
+                json.dump(summary, report_file, indent=2)
+            os.replace(tmp_path, self.report_path)
+
+
+# Global timer used by the whole pipeline
+timer = StageTimer(
+    config.timing_enabled,
+    config.timing_report_interval,
+    config.timing_report_path)
@@ -1,21 +1,22 @@
 import numpy as np
-from datetime import datetime as dt
 import config
 import facetools as ft
-from pyfacesdk import *
+from sdk import *
 import json
 import os.path as osp
 import cv2
+import frames
+import logger
+from frames import Frame
 
 
-def log(message, offset=0, log_in_file=False):
-	event_time = dt.now().time().isoformat()[0:-4]
-	print("%s%s%s" % (event_time, " " + "\t" * offset, message))
-	
-	if log_in_file:
-		log_lile = open(config.log_file, 'a')
-		log_file.writeline("%s%s%s" % (event_time, " " + "\t" * offset, message))
-		log_file.close()
+def log(message, offset=0, log_in_file=False, level=logger.INFO, key=None, **fields):
+	'''
+		Logs the message without blocking the caller,
+		records are written by the logger.logger thread.
+		Extra fields are written to the log file records.
+	'''
+	logger.logger.log(message, offset, level, log_in_file, key, **fields)
 
 
 def random_color(id):
@@ -97,6 +98,7 @@ def read_persons_data():
         descriptors_file.close()
 
         pers.update({"descriptor_file": descriptors_filename})
+        pers.update({"descriptors_raw": descriptors_data["descriptors"]})
         pers.update(
             {"descriptors": 
                 [list2desc(desc_list) for desc_list in descriptors_data["descriptors"]]
@@ -113,12 +115,14 @@ def draw_tracklet_on_frame(
     color=None,
     tlet_age=None,
     tlet_state=None,
-    tlet_name=None):
-
+    tlet_name=None,
+    rect=None):
 
+    # rect overrides the tracklet position,
+    # when it is not in the frame coordinates
     if color is None:
         color = random_color(tlet.id)
-    face = tlet.position
+    face = tlet.position if rect is None else rect
     x, y = face.x, face.y
     w, h = face.w, face.h
 
@@ -212,6 +216,14 @@ def list2desc(d_list):
     return Descriptor(d_barr)
 
 
+def desc2array(desc):
+    '''
+        Converts FaceSDK Descriptor object
+        to numpy array of uint8 (inverse of list2desc)
+    '''
+    return np.frombuffer(bytes(desc.data), np.uint8)
+
+
 def tlet2irect(tlet):
     '''
         Creating a IRect object from a tracklet object
@@ -221,6 +233,24 @@ def tlet2irect(tlet):
     return IRect(x, y, w, h)
 
 
+def crop_rect(frame, rect, margin=0.0):
+    '''
+        Copies a part of the frame around the rect
+        (IRect, URect or tracklet position) extended by
+        margin * size on every side.
+
+        Returns (crop, IRect of the face inside the crop)
+    '''
+    frame = frames.pixels(frame)
+    frame_h, frame_w = frame.shape[0], frame.shape[1]
+    dx, dy = int(rect.w * margin), int(rect.h * margin)
+    x0, y0 = max(0, rect.x - dx), max(0, rect.y - dy)
+    x1 = min(frame_w, rect.x + rect.w + dx)
+    y1 = min(frame_h, rect.y + rect.h + dy)
+    crop = frame[y0:y1, x0:x1].copy()
+    return crop, IRect(rect.x - x0, rect.y - y0, rect.w, rect.h)
+
+
 def img2irect(img):
     '''
         Creating and returns a IRect object which is 
@@ -229,12 +259,44 @@ def img2irect(img):
         Use it when you are working with cropped parts of image
     '''
     if type(img) is np.ndarray:
-        w, h = img.shape[0], img.shape[1]
+        h, w = img.shape[0], img.shape[1]
     elif type(img) is Image8U:
-        w, h = img.widht, img.height
+        w, h = img.width, img.height
     return IRect(0, 0, w, h)
 
 
+def to_image8u(img):
+    '''
+        Returns FaceSDK Image8U object for the image.
+        Image8U objects are passed through as is,
+        so the conversion happens only once.
+    '''
+    if type(img) is Image8U:
+        return img
+    if type(img) is Frame:
+        return img.image8u
+    return Image8U(img)
+
+
+def tracklet_record(tlet, results, timestamp, rect=None):
+    '''
+        Creates a JSON-serializable dict from a tracklet
+        and its FaceToolkit.analyze results.
+        rect overrides the tracklet position (see FaceToolkit.tlet_rect)
+    '''
+    face = tlet.position if rect is None else rect
+    emotion = results.get("emotion")
+    return {
+        "id": tlet.id,
+        "state": str(tlet.state),
+        "age": timestamp - int(tlet.start_time),
+        "rect": [face.x, face.y, face.w, face.h],
+        "attributes": results.get("attributes"),
+        "demographics": results.get("demographics"),
+        "emotion": None if emotion is None else str(emotion)
+    }
+
+
 def create_blank_image(h, w, elements=0):
     if elements:
         return np.ones((h, w, 3), np.uint8)
@@ -0,0 +1,173 @@
+import collections
+import os
+import os.path as osp
+import threading
+import time
+from datetime import datetime as dt
+
+import cv2
+import numpy as np
+
+import config
+import utils
+
+
+class VideoLogRecorder(threading.Thread):
+    '''
+        Writes annotated frames to the video log on a background thread.
+
+        put() only copies the frame into a recycled buffer and
+        appends it to a bounded queue, encoding with cv2.VideoWriter
+        runs on the recorder thread. When the encoder falls behind
+        and the queue is full, frames are dropped by the policy:
+            DROP_OLDEST - the oldest queued frame is dropped
+            DROP_NEWEST - the new frame is not queued
+
+        The log is split into segments, a new segment file is
+        started after segment_duration seconds or when the current
+        one grows to segment_size bytes (None disables the limit).
+    '''
+
+    DROP_OLDEST = "oldest"
+    DROP_NEWEST = "newest"
+
+    def __init__(self, fps, filename=None, queue_size=None, policy=None,
+            segment_duration=None, segment_size=None, fourcc=None):
+        threading.Thread.__init__(self, name="VideoLogRecorder", daemon=True)
+        self.fps = fps or 25.0
+        self.filename = filename or config.videolog_filename
+        self.queue_size = max(1, queue_size or config.videolog_queue_size)
+        self.policy = policy or config.videolog_drop_policy
+        self.segment_duration = config.videolog_segment_duration if segment_duration is None else segment_duration
+        self.segment_size = config.videolog_segment_size if segment_size is None else segment_size
+        self.fourcc = cv2.VideoWriter_fourcc(*(fourcc or config.videolog_fourcc))
+
+        self.queue = collections.deque()
+        self.free_buffers = []
+        self.cond = threading.Condition()
+        self.stopped = False
+
+        self.writer = None
+        self.segment_path = None
+        self.last_segment_path = None
+        self.segment_start = None
+        self.segment_shape = None
+
+        self.frames_encoded = 0
+        self.frames_dropped = 0
+        self.segments = 0
+
+
+    def put(self, img):
+        '''
+            Queues a copy of the frame (numpy array) for encoding.
+            Returns False if the frame was dropped.
+        '''
+        with self.cond:
+            if self.stopped:
+                return False
+            if len(self.queue) >= self.queue_size:
+                self.frames_dropped += 1
+                if self.policy == self.DROP_NEWEST:
+                    return False
+                self.free_buffers.append(self.queue.popleft())
+            buffer = None
+            while self.free_buffers and buffer is None:
+                buffer = self.free_buffers.pop()
+                if buffer.shape != img.shape:
+                    buffer = None
+
+        # Copying is done outside of the lock, the
+        # recorder thread is not blocked meanwhile
+        if buffer is None:
+            buffer = np.empty_like(img)
+        np.copyto(buffer, img)
+
+        with self.cond:
+            self.queue.append(buffer)
+            self.cond.notify()
+        return True
+
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopped:
+                    self.cond.wait()
+                if not self.queue:
+                    break
+                buffer = self.queue.popleft()
+
+            self.write(buffer)
+            with self.cond:
+                self.free_buffers.append(buffer)
+
+        self.close_segment()
+
+
+    def write(self, img):
+        if self.need_new_segment(img):
+            self.close_segment()
+            self.open_segment(img.shape)
+        self.writer.write(img)
+        self.frames_encoded += 1
+
+
+    def need_new_segment(self, img):
+        if self.writer is None or img.shape != self.segment_shape:
+            return True
+        if self.segment_duration and time.time() - self.segment_start >= self.segment_duration:
+            return True
+        # File size is checked once a second of video
+        if self.segment_size and self.frames_encoded % max(1, int(self.fps)) == 0:
+            return osp.getsize(self.segment_path) >= self.segment_size
+        return False
+
+
+    def open_segment(self, shape):
+        self.segment_start = time.time()
+        self.segment_shape = shape
+        if self.segment_duration or self.segment_size:
+            root, ext = osp.splitext(self.filename)
+            self.segment_path = "%s_%s%s" % (root, dt.now().strftime("%Y%m%d_%H%M%S"), ext)
+            if self.segment_path == self.last_segment_path:
+                self.segment_path = "%s_%s_%d%s" % (
+                    root, dt.now().strftime("%Y%m%d_%H%M%S"), self.segments, ext)
+        else:
+            self.segment_path = self.filename
+
+        segment_dir = osp.dirname(self.segment_path)
+        if segment_dir and not osp.isdir(segment_dir):
+            os.makedirs(segment_dir)
+        self.writer = cv2.VideoWriter(
+            self.segment_path, self.fourcc, self.fps, (shape[1], shape[0]))
+        self.segments += 1
+        utils.log("Video log segment started: %s" % self.segment_path)
+
+
+    def close_segment(self):
+        if self.writer is None:
+            return
+        self.writer.release()
+        self.writer = None
+        self.last_segment_path = self.segment_path
+
+
+    def close(self):
+        '''
+            Encodes the queued frames and closes the last segment
+        '''
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.join()
+
+
+    def stats(self):
+        with self.cond:
+            return {
+                "encoded": self.frames_encoded,
+                "dropped": self.frames_dropped,
+                "queued": len(self.queue),
+                "segments": self.segments
+            }
@@ -0,0 +1,239 @@
+import json
+import os
+import os.path as osp
+import queue
+import threading
+import time
+from datetime import datetime as dt
+
+import config
+import logger
+import utils
+
+
+class VisitCounter:
+    '''
+        In-memory counters state built from visit events.
+        The state is a plain dict, so it can be saved
+        to the journal snapshot as is.
+    '''
+
+    def __init__(self, state=None):
+        if state is None:
+            state = {
+                "visits": 0,
+                "returning": 0,
+                "last_visitor_id": 0,
+                "by_camera": {},
+                "by_day": {}
+            }
+        self.state = state
+
+
+    def next_visitor_id(self):
+        return self.state["last_visitor_id"] + 1
+
+
+    def apply(self, event):
+        state = self.state
+        state["visits"] += 1
+        if event.get("returning"):
+            state["returning"] = state.get("returning", 0) + 1
+        state["last_visitor_id"] = max(state["last_visitor_id"], event["visitor_id"])
+        camera = str(event["camera"])
+        state["by_camera"][camera] = state["by_camera"].get(camera, 0) + 1
+        day = event["time"][:10]
+        state["by_day"][day] = state["by_day"].get(day, 0) + 1
+
+
+class VisitJournal(threading.Thread):
+    '''
+        Append-only journal of visit events (JSON lines).
+
+        record() only updates the counters and puts the event
+        to a queue, the writer thread appends events in batches
+        and calls fsync not more often than fsync_interval seconds.
+
+        Every snapshot_every events the counters state is saved
+        with the journal offset it corresponds to, so on restart
+        only the journal tail after the snapshot is replayed.
+    '''
+
+    def __init__(self, path=None, batch_size=None, fsync_interval=None, snapshot_every=None):
+        threading.Thread.__init__(self, name="VisitJournal", daemon=True)
+        self.path = path or config.visits_journal_path
+        self.snapshot_path = self.path + ".snapshot"
+        self.batch_size = batch_size or config.visits_batch_size
+        self.fsync_interval = config.visits_fsync_interval if fsync_interval is None else fsync_interval
+        self.snapshot_every = snapshot_every or config.visits_snapshot_every
+
+        journal_dir = osp.dirname(self.path)
+        if journal_dir and not osp.isdir(journal_dir):
+            os.makedirs(journal_dir)
+
+        self.queue = queue.Queue()
+        self.counter = self.load()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.stopped = False
+
+
+    def load(self):
+        '''
+            Rebuilds counters from the snapshot and the journal tail
+        '''
+        state, offset = None, 0
+        if osp.isfile(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            state, offset = snapshot["state"], snapshot["offset"]
+
+        counter = VisitCounter(state)
+        replayed = 0
+        if osp.isfile(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.seek(offset)
+                end = offset
+                for line in journal_file:
+                    # The last line could be cut by a crash
+                    if not line.endswith(b"\n"):
+                        break
+                    counter.apply(json.loads(line))
+                    replayed += 1
+                    end += len(line)
+                # New events are appended after the last complete line
+                journal_file.seek(0, os.SEEK_END)
+                if journal_file.tell() > end:
+                    utils.log("Visits journal: torn last line is dropped (%d bytes)" %
+                        (journal_file.tell() - end))
+                    journal_file.truncate(end)
+        utils.log("Visits journal loaded: %d visits, %d events replayed" %
+            (counter.state["visits"], replayed))
+        return counter
+
+
+    def record(self, event):
+        # Counters and the queue are updated together,
+        # so a snapshot never counts an unwritten event
+        with self.lock:
+            self.counter.apply(event)
+            self.queue.put(event)
+
+
+    def new_visitor_id(self):
+        with self.lock:
+            visitor_id = self.counter.next_visitor_id()
+            self.counter.state["last_visitor_id"] = visitor_id
+        return visitor_id
+
+
+    def run(self):
+        last_fsync = time.time()
+        since_snapshot = 0
+        # Events written since the last fsync
+        dirty = False
+        with open(self.path, 'ab') as journal_file:
+            while True:
+                timeout = self.fsync_interval or 1.0
+                if dirty:
+                    # Written events are synced in fsync_interval
+                    # even if no more events come
+                    timeout = max(0.0, last_fsync + self.fsync_interval - time.time())
+                batch = self.next_batch(timeout)
+                if batch:
+                    journal_file.write(b"".join(
+                        (json.dumps(event) + "\n").encode() for event in batch))
+                    journal_file.flush()
+                    self.written += len(batch)
+                    since_snapshot += len(batch)
+                    dirty = True
+
+                now = time.time()
+                if dirty and now - last_fsync >= self.fsync_interval:
+                    os.fsync(journal_file.fileno())
+                    last_fsync = now
+                    dirty = False
+
+                if since_snapshot >= self.snapshot_every:
+                    os.fsync(journal_file.fileno())
+                    last_fsync = now
+                    dirty = False
+                    self.save_snapshot(journal_file.tell())
+                    since_snapshot = 0
+
+                if self.stopped and self.queue.empty():
+                    break
+
+            os.fsync(journal_file.fileno())
+            self.save_snapshot(journal_file.tell())
+
+
+    def next_batch(self, timeout):
+        '''
+            Waits up to timeout seconds for the first event and
+            collects up to batch_size events already in the queue
+        '''
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return [event for event in batch if not event is None]
+
+
+    def save_snapshot(self, offset):
+        # Events are applied to counters before they are written,
+        # so the state is taken when the queue is drained
+        with self.lock:
+            if not self.queue.empty():
+                return
+            snapshot = {"offset": offset, "state": self.counter.state}
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+        os.replace(tmp_path, self.snapshot_path)
+
+
+    def close(self):
+        self.stopped = True
+        self.queue.put(None)
+        self.join()
+
+
+def visit_event(entry, visitor_id, returning=False, camera=None):
+    '''
+        Creates a visit event from finished tracklet
+        results entry (facetools.TrackletResults)
+    '''
+    return {
+        "time": dt.now().isoformat(),
+        "camera": config.camera_name if camera is None else camera,
+        "visitor_id": visitor_id,
+        "returning": returning,
+        "tracklet_id": entry.id,
+        "start": entry.first_seen,
+        "end": entry.last_seen,
+        "duration": entry.last_seen - entry.first_seen,
+        "attributes": entry.attributes,
+        "demographics": entry.demographics
+    }
+
+
+def record_visit(journal, entry, visitor_id, returning=False, person=None):
+    '''
+        Records the visit of a finished tracklet to the journal.
+        person is the recognized known person {"id": ..., "name": ...}
+    '''
+    event = visit_event(entry, visitor_id, returning)
+    if not person is None:
+        event["person_id"] = person["id"]
+        event["person_name"] = person["name"]
+    journal.record(event)
+    utils.log("Visit of visitor %d, tracklet %d" % (visitor_id, entry.id),
+        level=logger.DEBUG, key="visit", visitor_id=visitor_id,
+        tracklet_id=entry.id, duration=event["duration"], returning=returning)
+    return event
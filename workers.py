@@ -0,0 +1,235 @@
+import queue
+import threading
+import time
+
+import config
+import facetools
+import timing
+import logger
+import utils
+import visits
+from sdk import *
+
+
+class ClassifierJob:
+    '''
+        Classification request of one tracklet.
+        Holds only a copy of the face crop, not the full frame
+    '''
+
+    def __init__(self, cache, tlet_id, crop, facerect, timestamp, need_stable, need_emotion):
+        self.cache = cache
+        self.tlet_id = tlet_id
+        self.crop = crop
+        self.facerect = facerect
+        self.timestamp = timestamp
+        self.need_stable = need_stable
+        self.need_emotion = need_emotion
+        self.submit_time = time.perf_counter()
+
+
+class ClassifierWorker(threading.Thread):
+    '''
+        Runs points detection and classifiers for jobs
+        from the pool queue. Every worker owns its own
+        FaceSDK objects, so they are never shared between threads
+    '''
+
+    def __init__(self, pool, n):
+        threading.Thread.__init__(self, name="ClassifierWorker-%d" % n, daemon=True)
+        self.pool = pool
+        self.points_detector = IPointsDetector()
+        self.attr_classifier = IAttributes()
+        self.demo_classifier = IDemographics()
+        self.emo_classifier = IEmotions()
+
+
+    def run(self):
+        while True:
+            job = self.pool.queue.get()
+            if job is None:
+                break
+            try:
+                self.process(job)
+            except Exception as e:
+                self.pool.failed += 1
+                utils.log("Classifier job of tracklet %d failed: %s" % (job.tlet_id, str(e)),
+                    level=logger.ERROR, key="classifier_failed")
+                with job.cache.lock:
+                    entry = job.cache.entries.get(job.tlet_id)
+                    if not entry is None:
+                        entry.pending = False
+
+
+    def process(self, job):
+        img8u = Image8U(job.crop)
+        points = self.points_detector.detectFromBbox(img8u, job.facerect)
+
+        attributes = demographics = emotion = None
+        if job.need_stable:
+            attributes = facetools.attributes2dict(
+                self.attr_classifier.classify(img8u, points))
+            demographics = facetools.demographics2dict(
+                self.demo_classifier.classify(img8u, points))
+        if job.need_emotion:
+            emotion = self.emo_classifier.classify(img8u, points).value
+
+        with job.cache.lock:
+            # Tracklet could be evicted while the job was in the queue
+            entry = job.cache.entries.get(job.tlet_id)
+            if not entry is None:
+                if job.need_stable and not entry.converged:
+                    entry.add_stable(attributes, demographics)
+                if job.need_emotion:
+                    entry.set_emotion(emotion, job.timestamp)
+                entry.updated_time = job.timestamp
+                entry.pending = False
+
+        self.pool.completed += 1
+        timing.timer.record("classifier_job", (time.perf_counter() - job.submit_time) * 1000.0)
+
+
+class ClassifierPool:
+    '''
+        Bounded pool of classifier worker threads.
+
+        submit() never blocks the frame loop: when the queue
+        is full the job is dropped and will be submitted again
+        on one of the next frames.
+    '''
+
+    def __init__(self, workers_num, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+        self.workers = [ClassifierWorker(self, n) for n in range(workers_num)]
+        for worker in self.workers:
+            worker.start()
+
+
+    def submit(self, cache, tlet, frame, timestamp, need_stable, need_emotion, tlet_rect=None):
+        '''
+            Returns True if the job was queued.
+            tlet_rect is the tracklet rect in the frame coordinates
+            (tracklet position by default)
+        '''
+        if tlet_rect is None:
+            tlet_rect = tlet.position
+        crop, facerect = utils.crop_rect(frame, tlet_rect, config.classifier_crop_margin)
+        job = ClassifierJob(
+            cache, tlet.id, crop, facerect, timestamp, need_stable, need_emotion)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.submitted += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+    def stop(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+
+
+class VisitWorker(threading.Thread):
+    '''
+        Identifies visitors of finished tracklets off the frame loop.
+
+        For every submitted visit the descriptor is extracted from
+        the best frame crop, the visitor is re-identified in the
+        visitors gallery, recognized in the known persons gallery
+        and the visit is recorded to the journal. Visits are
+        processed in order by one thread, which owns its FaceSDK
+        objects and is the only user of the visitors gallery.
+    '''
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="VisitWorker", daemon=True)
+        self.queue = queue.Queue()
+        self.points_detector = IPointsDetector()
+        self.extractor = IExtractor()
+        self.matcher = IMatcher()
+        self.completed = 0
+        self.failed = 0
+
+
+    def submit(self, entry, journal, visitors=None, known=None):
+        self.queue.put((entry, journal, visitors, known))
+
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            entry, journal = job[:2]
+            try:
+                self.process(*job)
+            except Exception as e:
+                self.failed += 1
+                utils.log("Visitor of tracklet %d is not identified: %s" % (entry.id, str(e)),
+                    level=logger.ERROR, key="visit_failed")
+                # The visit is counted anyway
+                visits.record_visit(journal, entry, journal.new_visitor_id())
+
+
+    def best_face_descriptor(self, entry):
+        '''
+            Extracts a descriptor from the best quality frame
+            kept for the entry. Returns None if no crop was kept.
+        '''
+        best = entry.best_frames.best()
+        if best is None or best[2] is None:
+            return None
+        score, timestamp, crop, facerect = best
+        img8u = Image8U(crop)
+        points = self.points_detector.detectFromBbox(img8u, facerect)
+        return self.extractor.enroll(img8u, points)
+
+
+    def process(self, entry, journal, visitors, known):
+        with timing.timer.stage("reid"):
+            descriptor = self.best_face_descriptor(entry)
+            if descriptor is None or visitors is None:
+                visitor_id, returning = journal.new_visitor_id(), False
+            else:
+                visitor_id, returning = visitors.identify(
+                    utils.desc2array(descriptor), journal.new_visitor_id, self.matcher)
+
+            person = None
+            if not descriptor is None and not known is None:
+                matched = known.search(utils.desc2array(descriptor), self.matcher)
+                if matched:
+                    person = matched[0]
+        visits.record_visit(journal, entry, visitor_id, returning, person)
+        self.completed += 1
+
+
+    def stop(self):
+        '''
+            Records the queued visits and stops the worker
+        '''
+        self.queue.put(None)
+        self.join()